@@ -27,6 +27,31 @@ __version__ = pbr.version.VersionInfo('cruton').version_string()
 OPS = [
     cfg.StrOpt('host', default="127.0.0.1", help="API host IP."),
     cfg.IntOpt('port', default=5150, help="API port to use."),
+    cfg.IntOpt(
+        'response_cache_size',
+        default=4096,
+        help="Maximum number of single resource responses cached by each API"
+             " worker. Set to 0 to disable the cache."
+    ),
+    cfg.StrOpt(
+        'json_encoder',
+        default='auto',
+        choices=['auto', 'orjson', 'json'],
+        help="JSON encoder used to serialize responses. auto uses orjson"
+             " when it is installed."
+    ),
+    cfg.StrOpt(
+        'metrics_dir',
+        help="Directory the API workers write their metrics to, so /metrics"
+             " returns the metrics of every running worker. When not set"
+             " /metrics only returns the metrics of the worker answering."
+    ),
+    cfg.IntOpt(
+        'metrics_flush_interval',
+        default=5,
+        help="Seconds between writes of the metrics of a worker to the"
+             " metrics_dir."
+    ),
 ]
 
 # Load config and API options
@@ -44,7 +69,7 @@ DATA_OPS = [
     cfg.StrOpt(
         'driver',
         default="cassandra",
-        help="Name of the keyspace to store data."
+        help="Name of the data store driver, cassandra or sqlite."
     ),
     cfg.StrOpt(
         'username',
@@ -69,6 +94,72 @@ DATA_OPS = [
         'keyspace',
         default="cruton",
         help="Name of the keyspace to store data."
+    ),
+    cfg.StrOpt(
+        'database',
+        default="/var/lib/cruton/cruton.db",
+        help="Path of the database file used by the sqlite driver. Use"
+             " :memory: for a store which only lives as long as the process."
+    ),
+    cfg.IntOpt(
+        'executor_threads',
+        default=6,
+        help="Number of driver executor threads used by each API worker."
+    ),
+    cfg.IntOpt(
+        'health_check_interval',
+        default=30,
+        help="Seconds between health checks of the shared data store"
+             " session. Set to 0 to disable the health check."
+    ),
+    cfg.IntOpt(
+        'scan_limit',
+        default=10000,
+        help="Maximum number of rows returned at once by a query which has"
+             " to scan a table, a page token is returned for the rest. Set"
+             " to 0 to remove the limit."
+    ),
+    cfg.IntOpt(
+        'lookup_concurrency',
+        default=64,
+        help="Maximum number of in flight reads used to resolve rows found"
+             " within a lookup table."
+    ),
+    cfg.IntOpt(
+        'write_concurrency',
+        default=64,
+        help="Maximum number of in flight writes used when a request writes"
+             " many rows, such as a bulk device import."
+    ),
+    cfg.IntOpt(
+        'exists_cache_size',
+        default=4096,
+        help="Maximum number of parent entities and environments remembered"
+             " to exist by each API worker. Set to 0 to disable the cache."
+    ),
+    cfg.IntOpt(
+        'exists_cache_ttl',
+        default=60,
+        help="Seconds a parent entity or environment is remembered to exist."
+    ),
+    cfg.IntOpt(
+        'page_limit',
+        default=1000,
+        help="Maximum number of rows a client can request in one page."
+    ),
+    cfg.IntOpt(
+        'slow_query_threshold',
+        default=1000,
+        help="Milliseconds a search can take before it is written to the"
+             " slow query log, cruton.slow_query, with the statements it"
+             " executed. Set to 0 to only log failed and traced searches."
+    ),
+    cfg.FloatOpt(
+        'trace_sample_percent',
+        default=0,
+        help="Percentage of searches executed with cassandra tracing"
+             " enabled. Their trace events are written to the slow query"
+             " log."
     )
 ]
 DATA_OPS_GROUP = cfg.OptGroup(
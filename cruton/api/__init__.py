@@ -14,15 +14,21 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
-from flask import jsonify
 from flask_restful import Resource
 
+from cruton import serialize
+
 
 BASE_API_MAP = {
     'discovery': {
         'module': 'Discovery',
         'path': 'cruton.api.v1.discovery',
         'uri': '/discovery'
+    },
+    'metrics': {
+        'module': 'Metrics',
+        'path': 'cruton.api.v1.metrics',
+        'uri': '/metrics'
     }
 }
 
@@ -78,4 +84,4 @@ class DocRoot(Resource):
         }
 
     def get(self):
-        return jsonify(self.info)
+        return serialize.jsonify(self.info)
@@ -14,28 +14,178 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
-import datetime
-import collections
+import functools
+import hashlib
 
-from flask import jsonify, make_response, request
+from flask import g, make_response, request
+from flask import Response, stream_with_context
 from flask_restful import Resource
+from werkzeug.urls import url_encode
 
 from oslo_config import cfg
 
-import cruton
+from cruton import cache
+from cruton import data_store
+# Aliased, the metrics resource module is a submodule of this package.
+from cruton import metrics as cmetrics
+from cruton import serialize
 from cruton.main import APP
 
 
 CONF = cfg.CONF
-UTILS = cruton.dynamic_import(
-    path='cruton.data_store.drivers.%s.utils' % CONF['data_store']['driver']
-)
-MODEL = cruton.dynamic_import(
-    path='cruton.data_store.drivers.%s.models' % CONF['data_store']['driver']
-)
-QUERY = cruton.dynamic_import(
-    path='cruton.data_store.drivers.%s' % CONF['data_store']['driver']
-)
+DRIVER = data_store.DriverBase(name=CONF['data_store']['driver'])
+UTILS = DRIVER.utils
+MODEL = DRIVER.models
+
+# Serialized single resources and their ETags keyed by primary key and the
+#  representation returned.
+RESPONSE_CACHE = cache.TTLCache(maxsize=CONF['api']['response_cache_size'])
+JSON_MIMETYPE = serialize.JSON_MIMETYPE
+TEXT_MIMETYPE = 'text/plain'
+RESPONSE_MIMETYPES = [JSON_MIMETYPE, TEXT_MIMETYPE]
+
+
+def cache_metrics():
+    """Return the hits, misses and size of the caches of the process."""
+    caches = dict(UTILS.cache_stats(), response=RESPONSE_CACHE.stats())
+    samples = list()
+    for name, stats in caches.items():
+        labels = {'cache': name}
+        samples.append(('cruton_cache_hits_total', labels, stats['hits']))
+        samples.append(('cruton_cache_misses_total', labels, stats['misses']))
+        samples.append(('cruton_cache_entries', labels, stats['size']))
+    return samples
+
+
+cmetrics.COLLECTORS.append(cache_metrics)
+
+
+@APP.before_request
+def start_metrics():
+    """Start timing the request."""
+    cmetrics.current()
+
+
+@APP.after_request
+def record_metrics(response):
+    """Record the metrics of the request once the response is sent.
+
+    A streamed response is serialized after this returns, it is recorded
+    when the response is closed so the time taken to stream it is included.
+    """
+    rule = request.url_rule
+    response.call_on_close(
+        functools.partial(
+            cmetrics.record,
+            request_metrics=cmetrics.current(),
+            endpoint=rule.rule if rule is not None else 'unmatched',
+            method=request.method,
+            code=response.status_code,
+            path=getattr(getattr(g, 'query_plan', None), 'path', None)
+        )
+    )
+    return response
+
+
+@APP.after_request
+def access_path(response):
+    """Report the data store access path used to answer the request."""
+    query_plan = getattr(g, 'query_plan', None)
+    if query_plan is not None:
+        response.headers['Content-Access-Path'] = str(query_plan)
+    return response
+
+
+@APP.after_request
+def next_page(response):
+    """Link to the next page of a paginated listing.
+
+    A scan returning its first scan_limit rows is paginated without a limit
+    being requested, the rest are linked to in pages of page_limit rows.
+    """
+    page_token = getattr(g, 'next_page_token', None)
+    if page_token:
+        args = request.args.to_dict()
+        args.setdefault('limit', str(CONF['data_store']['page_limit']))
+        args['page_token'] = page_token
+        response.headers['Content-Next-Page-Token'] = page_token
+        response.headers['Link'] = '<%s?%s>; rel="next"' % (
+            request.base_url,
+            url_encode(args, sort=True)
+        )
+    return response
+
+
+def coerce_args(data, model_map, known_only=False):
+    """Return request arguments coerced by a model map.
+
+    Values are converted to the type the model map has for their key. Values
+    which already have that type are used as they are, nested values such as
+    variables are not copied.
+
+    :param data: Request arguments
+    :type data: dict
+    :param model_map: Argument names and their types
+    :type model_map: dict
+    :param known_only: Only return the arguments within the model map which
+                       have a value.
+    :type known_only: bool
+    :return: dict
+    """
+    args = dict()
+    for k, v in data.items():
+        kind = model_map.get(k)
+        if known_only and (kind is None or not v):
+            continue
+        elif kind is not None and v is not None and not isinstance(v, kind):
+            v = kind(v)
+        args[k] = v
+    return args
+
+
+class RequestInput(object):
+    """Body and query parameters of the current request, parsed once.
+
+    A resource loads its options for every model within its class hierarchy,
+    the body arguments are coerced once for each model map and shared.
+    """
+
+    def __init__(self):
+        self.body = request.json
+        self.query = request.args.to_dict()
+        self._args = dict()
+
+    @classmethod
+    def current(cls):
+        """Return the parsed input of the current request.
+
+        :return: RequestInput
+        """
+        parsed = getattr(g, 'request_input', None)
+        if parsed is None:
+            parsed = g.request_input = cls()
+        return parsed
+
+    def args(self, model_map):
+        """Return the body arguments coerced by a model map.
+
+        A body which is a list, a bulk request, has no arguments.
+
+        :param model_map: Argument names and their types
+        :type model_map: dict
+        :return: dict
+        """
+        key = id(model_map)
+        if key not in self._args:
+            if isinstance(self.body, dict):
+                self._args[key] = coerce_args(
+                    data=self.body,
+                    model_map=model_map,
+                    known_only=True
+                )
+            else:
+                self._args[key] = dict()
+        return dict(self._args[key])
 
 
 class ApiSkel(Resource):
@@ -44,62 +194,239 @@ class ApiSkel(Resource):
         self.app = APP
         self.endpoint = request.path
         self.utils = UTILS
+        # The data store connection is shared by every resource within the
+        #  running process, this will only setup the connection once.
         self.conn = self.utils.setup()
         self.models = MODEL
         self.exp = self.utils.Exceptions
         self.model = None
         self.args = dict()
         self.query = dict()
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.utils.close(conn=self.conn)  # Closes the connection to the data store
+        self.etag = None
 
     def _load_opts(self):
-        """Load available options based on items within the Models."""
-        model_map = self.model.__model_map__
-        if request.json:
-            for k, v in model_map.items():
-                if not isinstance(request.json, list):
-                    arg = request.json.get(k)
-                    if arg:
-                        self.args[k] = v(arg)
-
-        for k, v in request.args.items():
-            self.query[k] = v
-        self.query = self.convert(data=self.query)
-        self.args = self.convert(data=self.args)
+        """Load available options based on items within the Models.
+
+        The request is parsed once, see RequestInput, so loading the options
+        again for every model within the class hierarchy is cheap.
+        """
+        parsed = RequestInput.current()
+        self.args = parsed.args(model_map=self.model.__model_map__)
+        self.query = dict(parsed.query)
+
+    @property
+    def query_plan(self):
+        """Access path chosen by the data store for the current request."""
+        return getattr(g, 'query_plan', None)
+
+    @query_plan.setter
+    def query_plan(self, value):
+        g.query_plan = value
+
+    @property
+    def next_page_token(self):
+        """Page token of the next page of a paginated listing."""
+        return getattr(g, 'next_page_token', None)
+
+    @next_page_token.setter
+    def next_page_token(self, value):
+        g.next_page_token = value
 
     def convert(self, data):
-        if isinstance(data, basestring):
-            return str(data)
-        elif isinstance(data, collections.Mapping):
-            return dict(map(self.convert, data.iteritems()))
-        elif isinstance(data, collections.Iterable):
-            return type(data)(map(self.convert, data))
-        else:
-            return data
+        """Return the arguments of a body item coerced by the model map.
+
+        :param data: Body item
+        :type data: dict
+        :return: dict
+        """
+        return coerce_args(data=data, model_map=self.model.__model_map__)
 
     def set_kwargs(self, kwargs):
         """Dynamically set objects into the class using the provided kwargs"""
         for k, v in kwargs.items():
             setattr(self, '_%s' % k, v)
 
+    def _query_flag(self, name):
+        """Pop a boolean flag from the query parameters.
+
+        :param name: Query parameter name
+        :type name: string
+        :return: bool
+        """
+        return str(self.query.pop(name, '')).lower() in ('1', 'true', 'yes')
+
+    def _stream_mode(self):
+        """Return the streaming mode requested by the client.
+
+        Streaming is requested with the ``stream`` query parameter, set to
+        ``ndjson`` for newline delimited JSON or ``true`` for a JSON array.
+        An ``Accept: application/x-ndjson`` header also selects ndjson.
+
+        :return: string || None
+        """
+        stream = str(self.query.pop('stream', '')).lower()
+        accept = request.headers.get('Accept', '')
+        if stream == 'ndjson' or 'application/x-ndjson' in accept:
+            return 'ndjson'
+        elif stream in ('true', 'json', '1'):
+            return 'json'
+
     @staticmethod
-    def _friendly_return(hashable):
-        """Helper function to sanitize information before it's returned.
+    def _stream_response(items, mode):
+        """Return a chunked response serializing items as they are read.
 
-        :param hashable: dictionary
-        :return: ``dict``
+        :param items: Items to serialize
+        :type items: generator
+        :param mode: Streaming mode, ``json`` or ``ndjson``
+        :type mode: string
+        :return: Response || object
         """
-        sanitized = dict()
-        for key, value in hashable.items():
-            if isinstance(value, set):
-                value = list(value)
-            elif isinstance(value, datetime.datetime):
-                value = value.strftime('%d-%m-%Y %H:%M:%S')
-            sanitized[key] = value
+        encode = serialize.encoder()
+        serialize_timer = cmetrics.timer(stage='serialize')
+
+        def dumps(item):
+            with serialize_timer:
+                return encode(item)
+
+        def generate_ndjson():
+            for item in items:
+                yield dumps(item) + b'\n'
+
+        def generate_json():
+            separator = b'['
+            for item in items:
+                yield separator + dumps(item)
+                separator = b','
+            if separator == b'[':
+                yield separator
+            yield b']'
+
+        if mode == 'ndjson':
+            return Response(
+                stream_with_context(generate_ndjson()),
+                mimetype='application/x-ndjson'
+            )
         else:
-            return sanitized
+            return Response(
+                stream_with_context(generate_json()),
+                mimetype=JSON_MIMETYPE
+            )
+
+    @staticmethod
+    def _response_key(model, keys, mimetype):
+        """Return the response cache key of a single resource."""
+        return model.__name__, tuple(sorted(keys.items())), mimetype
+
+    def _etag(self, model, keys, mimetype):
+        """Return the ETag of a single resource.
+
+        The ETag is derived from the primary key, the time the row was last
+        updated and the representation returned. None is returned when the
+        row does not exist or when the response depends on search criteria.
+
+        :param model: DB Model object
+        :type model: object || query
+        :param keys: Primary key column names and values
+        :type keys: dict
+        :param mimetype: Mimetype of the representation returned
+        :type mimetype: string
+        :return: string || None
+        """
+        if self.query:
+            return None
+
+        updated_at = self.utils.updated_at(model=model, **keys)
+        if updated_at is None:
+            return None
+
+        version = repr(
+            (model.__name__, sorted(keys.items()), str(updated_at), mimetype)
+        )
+        return hashlib.sha1(version.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _etag_response(body, mimetype, etag=None):
+        """Return a response from a serialized body."""
+        resp = Response(body, mimetype=mimetype)
+        if etag:
+            resp.set_etag(etag)
+        return resp
+
+    def _cached_response(self, model, keys, mimetype=JSON_MIMETYPE):
+        """Return the response of a single resource without reading it.
+
+        A 304 is returned when the client already has the current version,
+        the cached response when this worker has one. None is returned when
+        the resource has to be read, see _cache_response.
+
+        :param model: DB Model object
+        :type model: object || query
+        :param keys: Primary key column names and values
+        :type keys: dict
+        :param mimetype: Mimetype of the representation returned
+        :type mimetype: string
+        :return: Response || None
+        """
+        self.etag = self._etag(model=model, keys=keys, mimetype=mimetype)
+        if self.etag is None:
+            return None
+
+        if request.if_none_match.contains(self.etag):
+            resp = make_response('', 304)
+            resp.set_etag(self.etag)
+            return resp
+
+        cached = RESPONSE_CACHE.get(
+            self._response_key(model=model, keys=keys, mimetype=mimetype)
+        )
+        if cached and cached[0] == self.etag:
+            return self._etag_response(
+                body=cached[1],
+                mimetype=mimetype,
+                etag=self.etag
+            )
+
+    def _cache_response(self, model, keys, item=None, body=None,
+                        mimetype=JSON_MIMETYPE):
+        """Return the response of a single resource caching it.
+
+        :param model: DB Model object
+        :type model: object || query
+        :param keys: Primary key column names and values
+        :type keys: dict
+        :param item: Resource returned as JSON
+        :type item: dict
+        :param body: Serialized resource, used instead of the item
+        :type body: string
+        :param mimetype: Mimetype of the representation returned
+        :type mimetype: string
+        :return: Response
+        """
+        if body is None:
+            body = serialize.dumps(item)
+        if self.etag is not None:
+            RESPONSE_CACHE.set(
+                self._response_key(model=model, keys=keys, mimetype=mimetype),
+                (self.etag, body)
+            )
+        return self._etag_response(
+            body=body,
+            mimetype=mimetype,
+            etag=self.etag
+        )
+
+    def _invalidate(self, model, keys):
+        """Remove a single resource from the response cache.
+
+        :param model: DB Model object
+        :type model: object || query
+        :param keys: Primary key column names and values
+        :type keys: dict
+        """
+        for mimetype in RESPONSE_MIMETYPES:
+            RESPONSE_CACHE.invalidate(
+                self._response_key(model=model, keys=keys, mimetype=mimetype)
+            )
 
     def _get(self, *args, **kwargs):
         pass
@@ -107,15 +434,18 @@ class ApiSkel(Resource):
     def _put(self, *args, **kwargs):
         pass
 
+    def _count(self, *args, **kwargs):
+        pass
+
     def get(self, **kwargs):
         """Default GET method. Returns 501 and arguments presented"""
         self.set_kwargs(kwargs=kwargs)
-        return make_response(jsonify(kwargs), 501)
+        return serialize.jsonify(kwargs, status=501)
 
     def head(self, **kwargs):
         """Default HEAD method. Returns 501 and arguments presented"""
         self.set_kwargs(kwargs=kwargs)
-        return make_response(jsonify(kwargs), 501)
+        return serialize.jsonify(kwargs, status=501)
 
 
 class ApiSkelRoot(ApiSkel):
@@ -137,9 +467,9 @@ class ApiSkelPath(ApiSkel):
     def put(self, **kwargs):
         """Default PUT method. Returns 501 and arguments presented"""
         self.set_kwargs(kwargs=kwargs)
-        return make_response(jsonify(kwargs), 501)
+        return serialize.jsonify(kwargs, status=501)
 
     def delete(self, **kwargs):
         """Default DELETE method. Returns 501 and arguments presented"""
         self.set_kwargs(kwargs=kwargs)
-        return make_response(jsonify(kwargs), 501)
+        return serialize.jsonify(kwargs, status=501)
@@ -14,12 +14,13 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
-from flask import jsonify, make_response, request, render_template_string, Response
+from flask import make_response, request
 from flask_restful import reqparse
 
 from oslo_config import cfg
 
 from cruton import exceptions as exps
+from cruton import serialize
 from cruton.api import v1 as v1_api
 from cruton.api.v1 import environment
 
@@ -41,6 +42,9 @@ set {{ k }} {{ v }}
 {% endfor %}
 """
 
+# The template is compiled once, it's rendered for every iPXE request.
+IPXE_TEMPLATE = v1_api.APP.jinja_env.from_string(IPXE)
+
 
 class BaseDevice(environment.Environment):
     """Specific environment, datacenter, row, rack, and host devices endpoint."""
@@ -48,7 +52,7 @@ class BaseDevice(environment.Environment):
     def __init__(self):
         """TODO"""
         super(BaseDevice, self).__init__()
-        self.model = self.models.Entities
+        self.model = self.models.Devices
         self._load_opts()
 
     def _get(self, ent_id=None, env_id=None, dev_id=None, **kwargs):
@@ -66,6 +70,38 @@ class BaseDevice(environment.Environment):
             self=self, ent_id=ent_id, env_id=env_id, dev_id=dev_id, **kwargs
         )
 
+    def _count(self, ent_id=None, env_id=None, **kwargs):
+        """Common count method.
+
+        :param ent_id: Entity ID
+        :type ent_id: string
+        :param ent_id: Environment ID
+        :type ent_id: string
+        :return: int
+        """
+        return self.utils.count_device(
+            self=self, ent_id=ent_id, env_id=env_id, **kwargs
+        )
+
+    def _put_bulk(self, ent_id=None, env_id=None, **kwargs):
+        """Common bulk PUT method.
+
+        :param ent_id: Entity ID
+        :type ent_id: string
+        :param ent_id: Environment ID
+        :type ent_id: string
+        :return: list, int
+        """
+        notice, code = self.utils.put_devices(
+            self=self, ent_id=ent_id, env_id=env_id, **kwargs
+        )
+        for dev_id, _ in kwargs.get('items', list()):
+            self._invalidate(
+                model=self.models.Devices,
+                keys={'ent_id': ent_id, 'env_id': env_id, 'dev_id': dev_id}
+            )
+        return notice, code
+
     def _put(self, ent_id=None, env_id=None, dev_id=None, **kwargs):
         """Common PUT method.
 
@@ -77,9 +113,14 @@ class BaseDevice(environment.Environment):
         :type dev_id: string
         :return: string, int
         """
-        return self.utils.put_device(
+        notice, code = self.utils.put_device(
             self=self, ent_id=ent_id, env_id=env_id, dev_id=dev_id, **kwargs
         )
+        self._invalidate(
+            model=self.models.Devices,
+            keys={'ent_id': ent_id, 'env_id': env_id, 'dev_id': dev_id}
+        )
+        return notice, code
 
 
 class Devices(BaseDevice, v1_api.ApiSkelRoot):
@@ -90,21 +131,37 @@ class Devices(BaseDevice, v1_api.ApiSkelRoot):
         super(Devices, self).__init__()
 
     def get(self, ent_id, env_id):
+        stream = self._stream_mode()
         try:
-            return jsonify(self._get(ent_id=ent_id, env_id=env_id))
+            if stream:
+                return self._stream_response(
+                    items=self._get(ent_id=ent_id, env_id=env_id, stream=True),
+                    mode=stream
+                )
+            return serialize.jsonify(self._get(ent_id=ent_id, env_id=env_id))
         except Exception as exp:
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
 
     def head(self, ent_id, env_id):
+        try:
+            count = self._count(
+                ent_id=ent_id,
+                env_id=env_id,
+                exact=self._query_flag('exact')
+            )
+        except exps.InvalidRequest as exp:
+            LOG.warn(exps.log_exception(exp))
+            return serialize.jsonify(str(exp), status=400)
+
         resp = make_response()
-        resp.headers['Content-Devices'] = len(self._get(ent_id=ent_id, env_id=env_id))
+        resp.headers['Content-Devices'] = count
         return resp
 
     def post(self, ent_id, env_id):
-        if not isinstance(request.json, list):
-            item_list = [request.json]
+        if isinstance(request.json, list):
+            return self._post_bulk(ent_id=ent_id, env_id=env_id)
         else:
-            item_list = request.json
+            item_list = [request.json]
 
         returns = list()
         for item in item_list:
@@ -129,6 +186,41 @@ class Devices(BaseDevice, v1_api.ApiSkelRoot):
         else:
             return returns, 201
 
+    def _post_bulk(self, ent_id, env_id):
+        """POST a list of devices as a bulk import.
+
+        The devices are written concurrently and a result is returned for
+        every item, in order. If any item failed the status code will be
+        207 and the failed items will contain an ERROR.
+
+        :param ent_id: Entity ID
+        :type ent_id: string
+        :param ent_id: Environment ID
+        :type ent_id: string
+        :return: tuple
+        """
+        items = list()
+        for item in request.json:
+            if not item:
+                continue
+            dev_id = item.pop('dev_id', None)
+            if not dev_id:
+                return make_response(
+                    '<dev_id> is missing from the POST', 400
+                )
+            else:
+                items.append((dev_id, item))
+
+        notice, code = self._put_bulk(
+            ent_id=ent_id,
+            env_id=env_id,
+            items=items
+        )
+        if code == 200:
+            return notice, 201
+        else:
+            return notice, code
+
 
 class Device(BaseDevice, v1_api.ApiSkelPath):
     """Specific environment, datacenter, row, rack, and host devices endpoint."""
@@ -148,37 +240,51 @@ class Device(BaseDevice, v1_api.ApiSkelPath):
         return self._dev_id
 
     def get(self, ent_id, env_id, dev_id=None):
+        keys = {'ent_id': ent_id, 'env_id': env_id, 'dev_id': dev_id}
         try:
+            resp = self._cached_response(model=self.models.Devices, keys=keys)
+            if resp is not None:
+                return resp
+
             dev = self._get(ent_id=ent_id, env_id=env_id, dev_id=dev_id)
             if not dev:
-                return make_response(jsonify('Does Not Exist'), 404)
+                return serialize.jsonify('Does Not Exist', status=404)
         except IndexError as exp:
             LOG.warn(exps.log_exception(exp))
-            return make_response(jsonify('Not Found'), 404)
+            return serialize.jsonify('Not Found', status=404)
         except self.exp.InvalidRequest as exp:
             LOG.error(exps.log_exception(exp))
-            return make_response(jsonify('Invalid Request'), 400)
+            return serialize.jsonify('Invalid Request', status=400)
         except Exception as exp:
             LOG.critical(exps.log_exception(exp))
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
         else:
-            return jsonify(
-                self._friendly_return(
-                    dev[0]
-                )
+            return self._cache_response(
+                model=self.models.Devices,
+                keys=keys,
+                item=dev[0]
             )
 
     def head(self, ent_id, env_id, dev_id=None):
         resp = make_response()
-        dev = self._get(ent_id=ent_id, env_id=env_id, dev_id=dev_id)
+        try:
+            dev = self._get(ent_id=ent_id, env_id=env_id, dev_id=dev_id)
+        except exps.InvalidRequest as exp:
+            LOG.warn(exps.log_exception(exp))
+            return serialize.jsonify(str(exp), status=400)
+
         if not len(dev) > 0:
             resp.headers['Content-Environment-Exists'] = False
             resp.status_code = 404
         else:
             device = dev[0]
             resp.headers['Content-Environment-Exists'] = True
-            resp.headers['Content-Environment-Last-Updated'] = device['updated_at']
-            resp.headers['Content-Environment-Created'] = device['created_at']
+            resp.headers['Content-Environment-Last-Updated'] = (
+                serialize.timestamp(device['updated_at'])
+            )
+            resp.headers['Content-Environment-Created'] = (
+                serialize.timestamp(device['created_at'])
+            )
             resp.headers['Content-Environment-uuid'] = device['id']
             resp.headers['Content-Environment-Description'] = device['description']
             resp.status_code = 200
@@ -206,26 +312,38 @@ class Ipxe(Device):
         self._dev_id = None
 
     def get(self, ent_id, env_id, dev_id=None):
+        keys = {'ent_id': ent_id, 'env_id': env_id, 'dev_id': dev_id}
         try:
-            dev = self._get(ent_id=ent_id, env_id=env_id, dev_id=dev_id)
-            if not dev:
-                return make_response(jsonify('Does Not Exist'), 404)
+            resp = self._cached_response(
+                model=self.models.Devices,
+                keys=keys,
+                mimetype=v1_api.TEXT_MIMETYPE
+            )
+            if resp is not None:
+                return resp
+
+            dev_vars = self.utils.get_device_vars(self=self, **keys)
+            if dev_vars is None:
+                return serialize.jsonify('Does Not Exist', status=404)
         except IndexError as exp:
             LOG.warn(exps.log_exception(exp))
-            return make_response(jsonify('Not Found'), 404)
+            return serialize.jsonify('Not Found', status=404)
         except self.exp.InvalidRequest as exp:
             LOG.error(exps.log_exception(exp))
-            return make_response(jsonify('Invalid Request'), 400)
+            return serialize.jsonify('Invalid Request', status=400)
         except Exception as exp:
             LOG.critical(exps.log_exception(exp))
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
         else:
+            # Only the iPXE variables are decoded.
             ipxe_vars = dict()
-            for k, v in dev[0].get('vars', dict()).items():
+            for k in dev_vars:
                 if k.startswith('ipxe'):
-                    ipxe_vars[k.replace('ipxe_', '')] = v
+                    ipxe_vars[k.replace('ipxe_', '')] = dev_vars[k]
             else:
-                return Response(
-                    render_template_string(IPXE, ipxe_vars=ipxe_vars),
-                    mimetype='text/plain'
+                return self._cache_response(
+                    model=self.models.Devices,
+                    keys=keys,
+                    body=IPXE_TEMPLATE.render(ipxe_vars=ipxe_vars),
+                    mimetype=v1_api.TEXT_MIMETYPE
                 )
@@ -14,13 +14,24 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
+import collections
+import hashlib
 import re
 
+from flask import json, make_response, request, Response
+from flask_restful import Resource
+
 import cruton
 import cruton.api as api
 import cruton.api.v1 as v1_api
 
 
+# The serialized discovery document and its ETag, set by build_document when
+#  the application registers its resources.
+Document = collections.namedtuple('Document', ['body', 'etag'])
+DOCUMENT = None
+
+
 def split_docs(doc_string):
     if doc_string:
         return [i.strip() for i in doc_string.splitlines() if i.strip()]
@@ -32,49 +43,79 @@ def locate_method(*args):
     return '.'.join(args)
 
 
-class Discovery(v1_api.ApiSkel):
-    """API Discovery Information"""
+def _inputs(rule, docs_func, info):
+    _raw_inputs = [i for i in rule.arguments if i != 'self']
+    if not _raw_inputs:
+        return
+    inputs = info['inputs'] = dict()
+    for _raw_input in _raw_inputs:
+        input_info = inputs[_raw_input] = dict()
+        _docs = getattr(docs_func, _raw_input)
+        _input_docs_split = split_docs(_docs.__doc__)
+        if not _input_docs_split:
+            break
+        input_info['documentation'] = _input_docs_split
+        for item in _input_docs_split:
+            if item.startswith(':type'):
+                input_info['type'] = re.sub(':', '', item).split()[-1]
+
+
+def routes(app):
+    """Return the routes of an application and their documentation.
+
+    :param app: Flask application with its resources registered
+    :type app: object
+    :return: dict
+    """
+    _routes = dict()
+    for rule in app.url_map.iter_rules():
+        lower_rule = rule.endpoint.lower()
+        if rule and (lower_rule != 'static' and lower_rule != 'docroot'):
+            info = _routes[rule.rule] = dict()
+            info['methods'] = sorted(rule.methods)
+
+            docs_ep = api.API_MAP[lower_rule]
+            docs_func = cruton.dynamic_import(
+                path=docs_ep['path'],
+                module=docs_ep['module']
+            )
+            if not docs_func:
+                continue
+            info['documentation'] = split_docs(doc_string=docs_func.__doc__)
+            _inputs(rule=rule, docs_func=docs_func, info=info)
+    else:
+        return _routes
+
+
+def build_document(app):
+    """Serialize the discovery document of an application once.
+
+    The routes of an application don't change once it's running, so the
+    document is built when the resources are registered and every request
+    is answered with the same body.
 
-    def __init__(self):
-        super(Discovery, self).__init__()
-        self.rule_endpoint = None
-        self._docs_ep = None
-        self._docs_func = None
-
-    def _inputs(self, rule, info):
-        _raw_inputs = [i for i in rule.arguments if i != 'self']
-        if not _raw_inputs:
-            return
-        inputs = info['inputs'] = dict()
-        for _raw_input in _raw_inputs:
-            input_info = inputs[_raw_input] = dict()
-            _docs = getattr(self._docs_func, _raw_input)
-            _input_docs_split = split_docs(_docs.__doc__)
-            if not _input_docs_split:
-                break
-            input_info['documentation'] = _input_docs_split
-            for item in _input_docs_split:
-                if item.startswith(':type'):
-                    input_info['type'] = re.sub(':', '', item).split()[-1]
+    :param app: Flask application with its resources registered
+    :type app: object
+    :return: Document
+    """
+    global DOCUMENT
+    body = json.dumps(routes(app=app), sort_keys=True).encode('utf-8')
+    DOCUMENT = Document(body=body, etag=hashlib.sha1(body).hexdigest())
+    return DOCUMENT
+
+
+# A plain Resource, the document doesn't need the data store setup done by
+#  ApiSkel for every request.
+class Discovery(Resource):
+    """API Discovery Information"""
 
     def get(self):
-        routes = dict()
-        for rule in self.app.url_map.iter_rules():
-            self.rule_endpoint = rule.endpoint.capitalize()
-            lower_rule = self.rule_endpoint.lower()
-            if rule and (lower_rule != 'static' and lower_rule != 'docroot'):
-                info = routes[rule.rule] = dict()
-                info['methods'] = list(rule.methods)
-
-                self._docs_ep = api.API_MAP[lower_rule]
-                self._docs_func = cruton.dynamic_import(
-                    path=self._docs_ep['path'],
-                    module=self._docs_ep['module']
-                )
-                if not self._docs_func:
-                    continue
-                _docs = split_docs(doc_string=self._docs_func.__doc__)
-                info['documentation'] = _docs
-                self._inputs(rule=rule, info=info)
-        else:
-            return routes
+        document = DOCUMENT or build_document(app=v1_api.APP)
+        if request.if_none_match.contains(document.etag):
+            resp = make_response('', 304)
+            resp.set_etag(document.etag)
+            return resp
+
+        resp = Response(document.body, mimetype=v1_api.JSON_MIMETYPE)
+        resp.set_etag(document.etag)
+        return resp
@@ -14,12 +14,13 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
-from flask import jsonify, make_response, request
+from flask import make_response, request
 from flask_restful import reqparse
 
 from oslo_config import cfg
 
 from cruton import exceptions as exps
+from cruton import serialize
 from cruton.api import v1 as v1_api
 
 from oslo_log import log as logging
@@ -61,6 +62,13 @@ class BaseEntity(v1_api.ApiSkel):
             **kwargs
         )
 
+    def _count(self, **kwargs):
+        """Common count method.
+
+        :return: int
+        """
+        return self.utils.count_entity(self=self, **kwargs)
+
     def _put(self, ent_id=None, **kwargs):
         """Common PUT method.
 
@@ -70,9 +78,11 @@ class BaseEntity(v1_api.ApiSkel):
         :type ent_id: dict
         :return: string, int
         """
-        return self.utils.put_entity(
+        notice, code = self.utils.put_entity(
             self=self, ent_id=ent_id, **kwargs
         )
+        self._invalidate(model=self.models.Entities, keys={'ent_id': ent_id})
+        return notice, code
 
 
 class Entities(v1_api.ApiSkelRoot, BaseEntity):
@@ -88,26 +98,39 @@ class Entities(v1_api.ApiSkelRoot, BaseEntity):
 
         :return: Response || object
         """
+        stream = self._stream_mode()
         try:
+            if stream:
+                return self._stream_response(
+                    items=self._get(stream=True),
+                    mode=stream
+                )
             get_ent = self._get()
-            if get_ent:
-                return jsonify(get_ent)
+            if get_ent or self.next_page_token:
+                return serialize.jsonify(get_ent)
             else:
-                make_response('Not Found', 404)
+                return serialize.jsonify('Not Found', status=404)
         except Exception as exp:
             LOG.error(exps.log_exception(exp))
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
 
     def head(self):
         """HEAD entities.
 
         A response will be returned containing headers with the current
-        entity count.
+        entity count. The count is kept on write, an exact count can be
+        requested with ``?exact=1``.
 
         :return: Response || object
         """
+        try:
+            count = self._count(exact=self._query_flag('exact'))
+        except exps.InvalidRequest as exp:
+            LOG.warn(exps.log_exception(exp))
+            return serialize.jsonify(str(exp), status=400)
+
         resp = make_response()
-        resp.headers['Content-Entities'] = len(self._get())
+        resp.headers['Content-Entities'] = count
         return resp
 
     def post(self):
@@ -158,30 +181,48 @@ class Entity(v1_api.ApiSkelPath, BaseEntity):
         :type ent_id: string
         :return: Response || object
         """
+        keys = {'ent_id': ent_id}
         try:
+            resp = self._cached_response(model=self.models.Entities, keys=keys)
+            if resp is not None:
+                return resp
+
             ent = self._get(ent_id=ent_id)
             if not ent:
-                return make_response(jsonify('Not Found'), 404)
+                return serialize.jsonify('Not Found', status=404)
         except self.exp.InvalidRequest as exp:
             LOG.error(exps.log_exception(exp))
-            return make_response(jsonify('Does Not Exist'), 404)
+            return serialize.jsonify('Does Not Exist', status=404)
         except Exception as exp:
             LOG.critical(exps.log_exception(exp))
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
         else:
-            return jsonify(self._friendly_return(ent[0]))
+            return self._cache_response(
+                model=self.models.Entities,
+                keys=keys,
+                item=ent[0]
+            )
 
     def head(self, ent_id):
         resp = make_response()
-        dev = self._get(ent_id=ent_id)
+        try:
+            dev = self._get(ent_id=ent_id)
+        except exps.InvalidRequest as exp:
+            LOG.warn(exps.log_exception(exp))
+            return serialize.jsonify(str(exp), status=400)
+
         if not len(dev) > 0:
             resp.headers['Content-Entity-Exists'] = False
             resp.status_code = 404
         else:
             device = dev[0]
             resp.headers['Content-Entity-Exists'] = True
-            resp.headers['Content-Entity-Last-Updated'] = device['updated_at']
-            resp.headers['Content-Entity-Created'] = device['created_at']
+            resp.headers['Content-Entity-Last-Updated'] = (
+                serialize.timestamp(device['updated_at'])
+            )
+            resp.headers['Content-Entity-Created'] = (
+                serialize.timestamp(device['created_at'])
+            )
             resp.headers['Content-Entity-uuid'] = device['id']
             resp.headers['Content-Entity-Description'] = device['description']
             resp.status_code = 200
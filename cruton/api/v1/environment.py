@@ -14,7 +14,7 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
-from flask import jsonify, make_response, request
+from flask import make_response, request
 from flask_restful import reqparse
 
 from oslo_config import cfg
@@ -23,6 +23,7 @@ from oslo_log import log as logging
 from cruton.api import v1 as v1_api
 from cruton.api.v1 import entity
 from cruton import exceptions as exps
+from cruton import serialize
 
 
 CONF = cfg.CONF
@@ -50,6 +51,17 @@ class BaseEnvironments(entity.BaseEntity):
             self=self, ent_id=ent_id, env_id=env_id, **kwargs
         )
 
+    def _count(self, ent_id=None, **kwargs):
+        """Common count method.
+
+        :param ent_id: Entity ID
+        :type ent_id: string
+        :return: int
+        """
+        return self.utils.count_environment(
+            self=self, ent_id=ent_id, **kwargs
+        )
+
     def _put(self, ent_id=None, env_id=None, **kwargs):
         """Common PUT method.
 
@@ -59,9 +71,14 @@ class BaseEnvironments(entity.BaseEntity):
         :type ent_id: string
         :return: string, int
         """
-        return self.utils.put_environment(
+        notice, code = self.utils.put_environment(
             self=self, ent_id=ent_id, env_id=env_id, **kwargs
         )
+        self._invalidate(
+            model=self.models.Environments,
+            keys={'ent_id': ent_id, 'env_id': env_id}
+        )
+        return notice, code
 
 
 class Environments(v1_api.ApiSkelRoot, BaseEnvironments):
@@ -71,26 +88,37 @@ class Environments(v1_api.ApiSkelRoot, BaseEnvironments):
         super(Environments, self).__init__()
 
     def get(self, ent_id):
+        stream = self._stream_mode()
         try:
+            if stream:
+                return self._stream_response(
+                    items=self._get(ent_id=ent_id, stream=True),
+                    mode=stream
+                )
             env = self._get(ent_id=ent_id)
-            if not env:
-                return make_response(jsonify('Does Not Exist'), 404)
+            if not env and not self.next_page_token:
+                return serialize.jsonify('Does Not Exist', status=404)
         except self.exp.InvalidRequest as exp:
             LOG.warn(exps.log_exception(exp))
-            return make_response(jsonify('Does Not Exist'), 404)
+            return serialize.jsonify('Does Not Exist', status=404)
         except Exception as exp:
             LOG.critical(exps.log_exception(exp))
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
         else:
-            return jsonify(
-                self._friendly_return(
-                    env[0]
-                )
-            )
+            return serialize.jsonify(env)
 
     def head(self, ent_id):
+        try:
+            count = self._count(
+                ent_id=ent_id,
+                exact=self._query_flag('exact')
+            )
+        except exps.InvalidRequest as exp:
+            LOG.warn(exps.log_exception(exp))
+            return serialize.jsonify(str(exp), status=400)
+
         resp = make_response()
-        resp.headers['Content-Environments'] = len(self._get(ent_id=ent_id))
+        resp.headers['Content-Environments'] = count
         return resp
 
     def post(self, ent_id):
@@ -135,34 +163,51 @@ class Environment(v1_api.ApiSkelPath, BaseEnvironments):
         return self._env_id
 
     def get(self, ent_id, env_id):
+        keys = {'ent_id': ent_id, 'env_id': env_id}
         try:
+            resp = self._cached_response(
+                model=self.models.Environments,
+                keys=keys
+            )
+            if resp is not None:
+                return resp
+
             env = self._get(ent_id=ent_id, env_id=env_id)
             if not env:
-                return make_response(jsonify('Does Not Exist'), 404)
+                return serialize.jsonify('Does Not Exist', status=404)
         except self.exp.InvalidRequest as exp:
             LOG.warn(exps.log_exception(exp))
-            return make_response(jsonify('Does Not Exist'), 404)
+            return serialize.jsonify('Does Not Exist', status=404)
         except Exception as exp:
             LOG.critical(exps.log_exception(exp))
-            return make_response(jsonify(str(exp)), 400)
+            return serialize.jsonify(str(exp), status=400)
         else:
-            return jsonify(
-                self._friendly_return(
-                    env[0]
-                )
+            return self._cache_response(
+                model=self.models.Environments,
+                keys=keys,
+                item=env[0]
             )
 
     def head(self, ent_id, env_id):
         resp = make_response()
-        dev = self._get(ent_id=ent_id, env_id=env_id)
+        try:
+            dev = self._get(ent_id=ent_id, env_id=env_id)
+        except exps.InvalidRequest as exp:
+            LOG.warn(exps.log_exception(exp))
+            return serialize.jsonify(str(exp), status=400)
+
         if not len(dev) > 0:
             resp.headers['Content-Environment-Exists'] = False
             resp.status_code = 404
         else:
             device = dev[0]
             resp.headers['Content-Environment-Exists'] = True
-            resp.headers['Content-Environment-Last-Updated'] = device['updated_at']
-            resp.headers['Content-Environment-Created'] = device['created_at']
+            resp.headers['Content-Environment-Last-Updated'] = (
+                serialize.timestamp(device['updated_at'])
+            )
+            resp.headers['Content-Environment-Created'] = (
+                serialize.timestamp(device['created_at'])
+            )
             resp.headers['Content-Environment-uuid'] = device['id']
             resp.headers['Content-Environment-Description'] = device['description']
             resp.status_code = 200
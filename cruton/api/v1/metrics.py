@@ -0,0 +1,29 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+from flask import Response
+from flask_restful import Resource
+
+from cruton import metrics
+
+
+# A plain Resource, rendering the metrics doesn't need the data store setup
+#  done by ApiSkel for every request.
+class Metrics(Resource):
+    """API metrics in the Prometheus text format"""
+
+    def get(self):
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
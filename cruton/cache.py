@@ -0,0 +1,112 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """Bounded in process cache with least recently used eviction.
+
+    Entries expire ``ttl`` seconds after they were set. Hits and misses are
+    counted so the effectiveness of a cache can be reported.
+
+    :param maxsize: Maximum number of entries
+    :type maxsize: int
+    :param ttl: Seconds an entry is valid for, 0 disables expiry
+    :type ttl: int
+    """
+
+    def __init__(self, maxsize, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value of an entry.
+
+        :param key: Entry key
+        :type key: object
+        :param default: Value returned when there is no valid entry
+        :type default: object
+        :return: object
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires and expires < time.time():
+                self.misses += 1
+                return default
+
+            # Re-insert the entry making it the most recently used.
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Set an entry, evicting the least recently used when full.
+
+        :param key: Entry key
+        :type key: object
+        :param value: Entry value
+        :type value: object
+        """
+        if self.maxsize <= 0:
+            return
+
+        expires = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove an entry.
+
+        :param key: Entry key
+        :type key: object
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return the size, hits and misses of the cache.
+
+        :return: dict
+        """
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
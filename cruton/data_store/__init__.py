@@ -14,26 +14,80 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
+import cruton
+
 
 class DriverBase(object):
-    def __init__(self):
-        raise NotImplemented()
+    """Data store driver.
 
-    def get_data(self, data_type=None, filters=None, traverse=False):
-        """Return data from the backend data store.
+    A driver is a package within ``cruton.data_store.drivers`` named after
+    the ``[data_store] driver`` option. The package provides a ``models``
+    module holding the models listed in ``models_required`` and a ``utils``
+    module holding the functions listed in ``functions_required``. The
+    functions are called with the API resource as ``self``.
 
-        :param data_type: Table or key to work from when retrieving data.
-        :param filters: Any filters used to return the data in a more concise way.
-        :param traverse: If data has children return all children.
-        :return:
-        """
-        raise NotImplemented()
+    :param name: Driver name
+    :type name: string
+    """
+
+    functions_required = [
+        'setup',
+        'close',
+        'cache_stats',
+        'get_entity',
+        'get_environment',
+        'get_device',
+        'get_device_vars',
+        'updated_at',
+        'count_entity',
+        'count_environment',
+        'count_device',
+        'put_entity',
+        'put_environment',
+        'put_device',
+        'put_devices'
+    ]
+
+    models_required = [
+        'Entities',
+        'Environments',
+        'Devices'
+    ]
+
+    def __init__(self, name):
+        self.name = name
+        path = 'cruton.data_store.drivers.%s' % name
+        self.utils = cruton.dynamic_import(path='%s.utils' % path)
+        self.models = cruton.dynamic_import(path='%s.models' % path)
+
+        missing = [
+            i for i in self.functions_required
+            if not callable(getattr(self.utils, i, None))
+        ]
+        missing.extend([
+            i for i in self.models_required if not hasattr(self.models, i)
+        ])
+        if not hasattr(self.utils, 'Exceptions'):
+            missing.append('Exceptions')
+        if missing:
+            raise NotImplementedError(
+                'Data store driver [ %s ] does not implement: %s'
+                % (name, ', '.join(missing))
+            )
+
+    def setup(self):
+        """Return the process wide connection of the driver."""
+        return self.utils.setup()
+
+    def close(self):
+        """Close the process wide connection of the driver."""
+        return self.utils.close()
 
-    def put_data(self, data_type=None, data=None):
-        """ Add data to a given data_type within a backend store.
+    def command(self, name):
+        """Return a data store management command of the driver.
 
-        :param data_type: Type of data to interact with.
-        :param data: data insert object.
-        :return:
+        :param name: Command name
+        :type name: string
+        :return: function
         """
-        raise NotImplemented()
+        return getattr(self.models, name)
@@ -14,10 +14,13 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
+import collections
 import uuid
 
 import cassandra.cqlengine.models as cql
 
+from cruton.data_store import search
+
 
 class CrutonBaseModel(cql.Model):
     __abstract__ = True
@@ -47,6 +50,10 @@ class CrutonBaseModel(cql.Model):
         value_type=cql.columns.Text()
     )
     description = cql.columns.Text(default=None)
+    # Lowercased values of the searchable columns, see search.search_tokens.
+    search_tokens = cql.columns.Set(
+        value_type=cql.columns.Text()
+    )
 
 
 class Entities(CrutonBaseModel):
@@ -123,6 +130,156 @@ class Devices(CrutonBaseModel):
     )
 
 
+class EnvironmentsByEntity(cql.Model):
+    """Lookup table of the environments within an entity.
+
+    The table also holds the links of an entity to its environments.
+    """
+
+    __options__ = CrutonBaseModel.__options__
+
+    ent_id = cql.columns.Text(partition_key=True)
+    env_id = cql.columns.Text(primary_key=True)
+    link = cql.columns.Text(default=None)
+
+
+class DevicesByEnvironment(cql.Model):
+    """Lookup table of the devices within an environment.
+
+    The table also holds the links of an environment to its devices.
+    """
+
+    __options__ = CrutonBaseModel.__options__
+
+    ent_id = cql.columns.Text(partition_key=True)
+    env_id = cql.columns.Text(partition_key=True)
+    dev_id = cql.columns.Text(primary_key=True)
+    link = cql.columns.Text(default=None)
+
+
+class EntitiesByTag(cql.Model):
+    """Inverted tag index of the entities."""
+
+    __options__ = CrutonBaseModel.__options__
+
+    tag = cql.columns.Text(partition_key=True)
+    ent_id = cql.columns.Text(primary_key=True)
+
+
+class EnvironmentsByTag(cql.Model):
+    """Inverted tag index of the environments within an entity."""
+
+    __options__ = CrutonBaseModel.__options__
+
+    tag = cql.columns.Text(partition_key=True)
+    ent_id = cql.columns.Text(partition_key=True)
+    env_id = cql.columns.Text(primary_key=True)
+
+
+class DevicesByTag(cql.Model):
+    """Inverted tag index of the devices within an environment."""
+
+    __options__ = CrutonBaseModel.__options__
+
+    tag = cql.columns.Text(partition_key=True)
+    ent_id = cql.columns.Text(partition_key=True)
+    env_id = cql.columns.Text(partition_key=True)
+    dev_id = cql.columns.Text(primary_key=True)
+
+
+class RowCounts(cql.Model):
+    """Number of rows within a table kept up to date on write.
+
+    Environment counts are keyed by their entity, device counts by their
+    entity and environment. Keys which don't apply are stored empty. A
+    count is only known to hold every row once seeded, by rebuild_lookups
+    or when the parent of the rows counted is created.
+    """
+
+    table_name = cql.columns.Text(partition_key=True)
+    ent_id = cql.columns.Text(partition_key=True)
+    env_id = cql.columns.Text(partition_key=True)
+    total = cql.columns.Counter()
+    seeded = cql.columns.Counter()
+
+
+# Lookup tables which can be used to resolve the primary keys of a model when
+#  its partition key is not known.
+LOOKUP_MODELS = {
+    Environments: EnvironmentsByEntity,
+    Devices: DevicesByEnvironment
+}
+
+# Models of the children of a row. The links of a row are read from the lookup
+#  table of its children rather than stored within the row, so writing a child
+#  doesn't write to its parent.
+CHILD_MODELS = {
+    Entities: Environments,
+    Environments: Devices
+}
+
+# Inverted tag index tables, appended to when the tags of a row are written.
+TAG_MODELS = {
+    Entities: EntitiesByTag,
+    Environments: EnvironmentsByTag,
+    Devices: DevicesByTag
+}
+
+
+def count_keys(model, keys):
+    """Return the row count key values for rows of a model.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Key column names and values
+    :type keys: dict
+    :return: dict
+    """
+    counted = {
+        'table_name': model._raw_column_family_name(),
+        'ent_id': '',
+        'env_id': ''
+    }
+    lookup = LOOKUP_MODELS.get(model)
+    if lookup is not None:
+        for k in lookup._partition_keys.keys():
+            counted[k] = keys[k]
+    return counted
+
+
+def _seed_counts():
+    """Recount the rows of every table and partition and seed their counts.
+
+    Counts of partitions without rows are seeded too, as are the counts of
+    the children of every row. Rows created while the rows are recounted
+    may be counted twice, run it before the API accepts writes.
+    """
+    def counted(model, keys):
+        return tuple(sorted(count_keys(model=model, keys=keys).items()))
+
+    totals = collections.Counter()
+    totals[counted(model=Entities, keys={})] += 0
+    for model in [Entities, Environments, Devices]:
+        child_model = CHILD_MODELS.get(model)
+        for row in model.objects.all().limit(None):
+            totals[counted(model=model, keys=row)] += 1
+            if child_model is not None:
+                totals[counted(model=child_model, keys=row)] += 0
+
+    for key_items, total in totals.items():
+        counts = RowCounts.objects(**dict(key_items))
+        kept = counts.first()
+        kept_total = kept_seeded = 0
+        if kept is not None:
+            kept_total = kept.total or 0
+            kept_seeded = kept.seeded or 0
+        if total != kept_total or not kept_seeded:
+            counts.update(
+                total=total - kept_total,
+                seeded=0 if kept_seeded else 1
+            )
+
+
 def sync_tables(keyspace):
     from cassandra.cqlengine import management
 
@@ -140,3 +297,74 @@ def sync_tables(keyspace):
         model=Devices,
         keyspaces=keyspace
     )
+
+    lookup_models = list(LOOKUP_MODELS.values()) + list(TAG_MODELS.values())
+    for lookup_model in lookup_models:
+        management.sync_table(
+            model=lookup_model,
+            keyspaces=keyspace
+        )
+
+    management.sync_table(
+        model=RowCounts,
+        keyspaces=keyspace
+    )
+
+    # A new keyspace holds no entities, the entity count is exact from the
+    #  start. Data stored before the counts existed is seeded by
+    #  rebuild_lookups.
+    if Entities.objects.all().limit(1).first() is None:
+        RowCounts.objects(**count_keys(model=Entities, keys={})).update(
+            seeded=1
+        )
+
+
+def rebuild_lookups(keyspace=None):
+    """Populate the lookup tables, search tokens and row counts.
+
+    Everything is rebuilt from the rows stored.
+    """
+    for model, lookup_model in LOOKUP_MODELS.items():
+        lookup_keys = list(lookup_model._primary_keys.keys())
+        for row in model.objects.all().limit(None):
+            lookup_model.create(**dict([(k, row[k]) for k in lookup_keys]))
+
+    # Links used to be stored within the parent row, move them to the lookup
+    #  table of the children.
+    for model, child_model in CHILD_MODELS.items():
+        lookup_model = LOOKUP_MODELS[child_model]
+        child_key = [
+            k for k in lookup_model._primary_keys.keys()
+            if k not in lookup_model._partition_keys
+        ][0]
+        for row in model.objects.all().limit(None):
+            for child_id, link in (row['links'] or dict()).items():
+                lookup_model.objects(
+                    **dict(
+                        [(k, row[k]) for k in lookup_model._partition_keys],
+                        **{child_key: child_id}
+                    )
+                ).update(link=link)
+
+    for model in [Entities, Environments, Devices]:
+        key_names = list(model._primary_keys.keys())
+        for row in model.objects.all().limit(None):
+            tokens = search.search_tokens(
+                args=dict(row.items()),
+                complete=True
+            )
+            if tokens:
+                model.objects(
+                    **dict([(k, row[k]) for k in key_names])
+                ).update(search_tokens=tokens)
+
+    for model, tag_model in TAG_MODELS.items():
+        tag_keys = [k for k in tag_model._primary_keys.keys() if k != 'tag']
+        for row in model.objects.all().limit(None):
+            for tag in row['tags']:
+                tag_model.create(
+                    tag=tag,
+                    **dict([(k, row[k]) for k in tag_keys])
+                )
+
+    _seed_counts()
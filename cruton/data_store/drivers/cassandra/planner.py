@@ -0,0 +1,124 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import models
+
+
+# Access paths in order of preference.
+PRIMARY_KEY = 'primary_key'
+PARTITION = 'partition'
+TAG = 'tag'
+LOOKUP = 'lookup'
+INDEX = 'index'
+SCAN = 'scan'
+
+
+class QueryPlan(object):
+    """Access path chosen for a lookup.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param path: Access path name
+    :type path: string
+    :param keys: Key column names and values known for the lookup
+    :type keys: dict
+    :param lookup: Lookup table model used to resolve primary keys
+    :type lookup: object || query
+    :param index: Indexed column name and value
+    :type index: tuple
+    """
+
+    def __init__(self, model, path, keys, lookup=None, index=None):
+        self.model = model
+        self.path = path
+        self.keys = keys
+        self.lookup = lookup
+        self.index = index
+
+    @property
+    def table(self):
+        return self.model._raw_column_family_name()
+
+    def __str__(self):
+        via = ''
+        if self.lookup is not None:
+            via = ' via %s' % self.lookup._raw_column_family_name()
+        elif self.index:
+            via = ' via %s index' % self.index[0]
+        return '%s %s%s [%s]' % (
+            self.path,
+            self.table,
+            via,
+            ', '.join(sorted(self.keys.keys()))
+        )
+
+
+def plan(model, keys, query=None, fuzzy=False, tag=None):
+    """Return the cheapest access path for a lookup.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Key column names and values known from the request path
+    :type keys: dict
+    :param query: Search parameters from the request
+    :type query: dict
+    :param fuzzy: Enables or disables a fuzzy search.
+    :type fuzzy: bool
+    :param tag: Tag searched for
+    :type tag: string
+    :return: QueryPlan
+    """
+    keys = dict([(k, v) for k, v in keys.items() if v])
+    if all([k in keys for k in model._primary_keys.keys()]):
+        return QueryPlan(model=model, path=PRIMARY_KEY, keys=keys)
+
+    if all([k in keys for k in model._partition_keys.keys()]):
+        return QueryPlan(model=model, path=PARTITION, keys=keys)
+
+    # Fuzzy searches can not use an index, the criteria is a partial match.
+    tag_model = models.TAG_MODELS.get(model)
+    if tag and not fuzzy and tag_model is not None:
+        tag_keys = [k for k in tag_model._partition_keys.keys() if k != 'tag']
+        if all([k in keys for k in tag_keys]):
+            return QueryPlan(
+                model=model,
+                path=TAG,
+                keys=keys,
+                lookup=tag_model,
+                index=('tag', tag)
+            )
+
+    lookup = models.LOOKUP_MODELS.get(model)
+    if lookup is not None:
+        if all([k in keys for k in lookup._partition_keys.keys()]):
+            return QueryPlan(
+                model=model,
+                path=LOOKUP,
+                keys=keys,
+                lookup=lookup
+            )
+
+    if query and not fuzzy:
+        for name in sorted(model._columns.keys()):
+            if model._columns[name].index and query.get(name):
+                return QueryPlan(
+                    model=model,
+                    path=INDEX,
+                    keys=keys,
+                    index=(name, query[name])
+                )
+
+    return QueryPlan(model=model, path=SCAN, keys=keys)
@@ -14,23 +14,44 @@
 
 # (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
 
+import atexit
+import base64
+import collections
 import datetime
-import re
 import json
+import os
+import random
+import threading
+import time
+import uuid
 
 import cassandra
+from cassandra import concurrent
+from cassandra.cqlengine import columns as cql_columns
 from cassandra.cqlengine import connection
+from cassandra.cqlengine import ValidationError
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.query import TraceUnavailable
 
 from oslo_config import cfg
 from oslo_log import log as logging
 
 import models
+import planner
 
+from cruton import cache
 from cruton import exceptions as exps
+from cruton import metrics
+from cruton.data_store import search
+from cruton.data_store import variables
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
+SLOW_LOG = logging.getLogger('cruton.slow_query')
+
+# Statements and trace events kept for each search within the slow query log.
+LOGGED_STATEMENTS = 100
+LOGGED_TRACE_EVENTS = 50
 
 
 class Exceptions(object):
@@ -53,119 +74,934 @@ def _auth_provider(conf):
         )
 
 
-def close(conn):
-    """Close any open Session."""
-    conn.shutdown()
+class SessionRegistry(object):
+    """Process wide registry for the cqlengine connection.
+
+    The connection is set up once per process and handed to every API
+    resource. Because uWSGI forks workers after the application is loaded
+    the registry tracks the pid which created the connection; a forked
+    worker will build its own connection the first time it is used.
+    """
+
+    health_query = 'SELECT release_version FROM system.local'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_check = 0
+        self._stale = False
+        self._statements = dict()
+
+    @property
+    def active(self):
+        """Return True when the connection belongs to the running process."""
+        return self._pid == os.getpid()
+
+    def _connect(self):
+        """Run the connection setup."""
+        cassandra_conf = CONF['data_store']
+        cluster_connect = dict(
+            hosts=cassandra_conf['cluster_node'],
+            port=cassandra_conf['port'],
+            default_keyspace=cassandra_conf['keyspace'],
+            executor_threads=cassandra_conf['executor_threads'],
+            retry_connect=True,
+            lazy_connect=True
+        )
+        auth_provider = _auth_provider(conf=cassandra_conf)
+        if auth_provider:
+            cluster_connect['auth_provider'] = auth_provider
+        connection.setup(**cluster_connect)
+        self._statements = dict()
+        self._pid = os.getpid()
+        self._last_check = time.time()
+        self._stale = False
+        LOG.info('Data store connection setup for process [ %s ]', self._pid)
+
+    def setup(self):
+        """Return the connection, setting it up if needed.
+
+        :return: object
+        """
+        if not self.active:
+            with self._lock:
+                if not self.active:
+                    self._connect()
+        elif self._stale:
+            with self._lock:
+                if self._stale:
+                    self._reconnect()
+        else:
+            interval = CONF['data_store']['health_check_interval']
+            if interval and time.time() - self._last_check > interval:
+                self.health_check()
+        return connection
+
+    def prepare(self, cql):
+        """Return a prepared statement from the cache, preparing on a miss.
+
+        Statements are bound to the session which prepared them so the cache
+        is reset whenever the connection is setup again.
+
+        :param cql: CQL query string
+        :type cql: string
+        :return: object
+        """
+        statement = self._statements.get(cql)
+        if statement is None:
+            with self._lock:
+                statement = self._statements.get(cql)
+                if statement is None:
+                    statement = connection.get_session().prepare(cql)
+                    self._statements[cql] = statement
+        return statement
+
+    def _reconnect(self):
+        """Replace a stale connection, then shutdown the old cluster.
+
+        Other threads of the worker may still be using the old session, it
+        is only shutdown once the new connection is registered.
+        """
+        cluster = connection.get_cluster()
+        self._connect()
+        try:
+            cluster.shutdown()
+        except Exception as exp:
+            LOG.warn(exps.log_exception(exp))
+
+    def health_check(self):
+        """Check the session and mark the connection stale when broken.
+
+        A stale connection is replaced the next time setup is called.
+
+        :return: bool
+        """
+        self._last_check = time.time()
+        try:
+            connection.get_session().execute(self.health_query)
+        except Exception as exp:
+            LOG.warn(exps.log_exception(exp))
+            self._stale = True
+            return False
+        else:
+            return True
+
+    def shutdown(self):
+        """Shutdown the connection owned by the running process."""
+        with self._lock:
+            if not self.active:
+                return
+            try:
+                connection.get_cluster().shutdown()
+            except Exception as exp:
+                LOG.warn(exps.log_exception(exp))
+            finally:
+                self._pid = None
+
+
+SESSION_REGISTRY = SessionRegistry()
+atexit.register(SESSION_REGISTRY.shutdown)
+
+
+def close(conn=None):
+    """Close the open Session for the running process."""
+    SESSION_REGISTRY.shutdown()
 
 
 def setup():
-    """Run the connection setup."""
-    cassandra_conf = CONF['data_store']
-    cluster_connect = dict(
-        hosts=cassandra_conf['cluster_node'],
-        port=cassandra_conf['port'],
-        default_keyspace=cassandra_conf['keyspace'],
-        executor_threads=6,
-        retry_connect=True,
-        lazy_connect=True
-    )
-    auth_provider = _auth_provider(conf=cassandra_conf)
-    if auth_provider:
-        cluster_connect['auth_provider'] = auth_provider
-    connection.setup(**cluster_connect)
-    return connection
+    """Return the process wide connection."""
+    return SESSION_REGISTRY.setup()
+
+
+def _table(model):
+    """Return the keyspace qualified table name of a model."""
+    return model.column_family_name(include_keyspace=True)
+
+
+def _where(keys):
+    """Return a bind marker WHERE clause for the given column names."""
+    return ' AND '.join(['%s = ?' % k for k in keys])
 
 
-def convert_from_json(q_got):
-    """Return a dict from a JSON variable.
+class Page(object):
+    """Page of rows requested with the limit and page_token parameters.
 
-    :param q_got: retrieved query
-    :type q_got: ``dict``
+    The page token is the driver paging state encoded as url safe base64.
+
+    :param size: Number of rows to fetch
+    :type size: int
+    :param token: Page token returned with the previous page
+    :type token: string
+    """
+
+    def __init__(self, size, token=None):
+        self.size = size
+        self.state = None
+        self.next_token = None
+        if token:
+            try:
+                self.state = base64.urlsafe_b64decode(str(token))
+            except (TypeError, ValueError):
+                raise exps.InvalidRequest('Invalid page_token [ %s ]', token)
+
+    def set_state(self, state):
+        """Store the paging state of the page which was just fetched."""
+        if state:
+            self.next_token = base64.urlsafe_b64encode(state).decode('ascii')
+        else:
+            self.next_token = None
+
+
+def _ms(delta):
+    """Return a timedelta, or a number of seconds, in milliseconds."""
+    if delta is None:
+        return None
+    elif isinstance(delta, datetime.timedelta):
+        delta = delta.total_seconds()
+    return round(delta * 1000, 3)
+
+
+def _trace_summary(response):
+    """Return the coordinator, duration and events of a traced statement.
+
+    :param response: Result or future of a statement executed with tracing
+    :type response: object
     :return: dict
     """
-    for k, v in q_got.get('vars', {}).items():
+    try:
+        trace = response.get_query_trace()
+    except TraceUnavailable as exp:
+        return {'ERROR': str(exp)}
+
+    return {
+        'coordinator': trace.coordinator,
+        'coordinator_ms': _ms(trace.duration),
+        'events': [
+            [_ms(event.source_elapsed), event.source, event.description]
+            for event in (trace.events or list())[:LOGGED_TRACE_EVENTS]
+        ]
+    }
+
+
+class QueryLog(object):
+    """Statements executed to answer a search, logged when it is slow.
+
+    While a query log is current the statements executed by the thread are
+    added to it. A search is written to the slow query log when it takes
+    longer than slow_query_threshold or fails. A sampled search executes its
+    statements with tracing enabled and is always logged with their traces.
+
+    :param query_plan: Query plan of the search
+    :type query_plan: object
+    """
+
+    _local = threading.local()
+
+    def __init__(self, query_plan):
+        self.query_plan = query_plan
+        self.statements = list()
+        self.statement_count = 0
+        self.rows_fetched = 0
+        self.rows_returned = 0
+        self.error = None
+        self.finished = False
+        self.started = time.time()
+        percent = CONF['data_store']['trace_sample_percent']
+        self.trace = percent > 0 and random.random() * 100 < percent
+        self._previous = None
+
+    @classmethod
+    def current(cls):
+        """Return the query log of the running thread, if any.
+
+        :return: QueryLog || None
+        """
+        return getattr(cls._local, 'query_log', None)
+
+    def __enter__(self):
+        self._previous = self.current()
+        self._local.query_log = self
+        return self
+
+    def __exit__(self, *args):
+        self._local.query_log = self._previous
+
+    def statement(self, cql, params, executions=1):
+        """Add a statement, returning its entry when it is kept.
+
+        :param cql: CQL query string
+        :type cql: string
+        :param params: Bind parameters
+        :type params: list
+        :param executions: Number of times the statement is executed
+        :type executions: int
+        :return: dict || None
+        """
+        self.statement_count += 1
+        if len(self.statements) >= LOGGED_STATEMENTS:
+            return None
+
+        entry = {
+            'cql': cql,
+            'params': params,
+            'executions': executions,
+            'started': time.time(),
+            'elapsed': None,
+            'response': None
+        }
+        self.statements.append(entry)
+        return entry
+
+    @staticmethod
+    def executed(entry, response=None):
+        """Set how long the statement of an entry took.
+
+        :param entry: Statement entry
+        :type entry: dict
+        :param response: Result or future, kept when the statement is traced
+        :type response: object
+        """
+        if entry['elapsed'] is None:
+            entry['elapsed'] = time.time() - entry['started']
+        if response is not None:
+            entry['response'] = response
+
+    def fetched(self, rows):
+        """Return a generator counting the rows read from the data store.
+
+        The query log is current while each row is read, so statements
+        executed as the rows are consumed are added.
+
+        :param rows: Rows read from the data store
+        :type rows: iterable
+        :return: generator
+        """
+        rows = iter(rows)
+        while True:
+            with self:
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+            self.rows_fetched += 1
+            yield row
+
+    def returned(self, items):
+        """Return a generator counting the items returned by the search.
+
+        The search is finished once the items are consumed.
+
+        :param items: Items returned
+        :type items: iterable
+        :return: generator
+        """
         try:
-            q_got['vars'][k] = json.loads(v)
-        except ValueError:
-            pass
-    else:
-        return q_got
+            for item in items:
+                self.rows_returned += 1
+                yield item
+        except Exception as exp:
+            self.finish(error=exp)
+            raise
+        finally:
+            self.finish()
+
+    def summary(self):
+        """Return the search and its statements as a dict.
+
+        Traces are read from the data store when the summary is made.
+
+        :return: dict
+        """
+        statements = list()
+        for entry in self.statements:
+            statement = {
+                'cql': entry['cql'],
+                'params': entry['params'],
+                'executions': entry['executions'],
+                'allow_filtering': 'ALLOW FILTERING' in entry['cql'],
+                'elapsed_ms': _ms(entry['elapsed'])
+            }
+            if entry['response'] is not None:
+                statement['trace'] = _trace_summary(entry['response'])
+            statements.append(statement)
+
+        return {
+            'access_path': self.query_plan.path,
+            'query_plan': str(self.query_plan),
+            'elapsed_ms': _ms(time.time() - self.started),
+            'rows_fetched': self.rows_fetched,
+            'rows_returned': self.rows_returned,
+            'statement_count': self.statement_count,
+            'statements': statements,
+            'traced': self.trace,
+            'error': str(self.error) if self.error is not None else None
+        }
 
+    def finish(self, error=None):
+        """Write the search to the slow query log when it has to be logged.
+
+        :param error: Exception raised by the search
+        :type error: object
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.error = error
+
+        threshold = CONF['data_store']['slow_query_threshold']
+        elapsed = (time.time() - self.started) * 1000
+        slow = threshold > 0 and elapsed >= threshold
+        if slow or error is not None:
+            log = SLOW_LOG.warn
+        elif self.trace:
+            log = SLOW_LOG.info
+        else:
+            return
+
+        log(
+            'Search [ %s ]: %s',
+            self.query_plan,
+            json.dumps(self.summary(), default=str, sort_keys=True)
+        )
 
-def deep_search(data_structure, criteria, fuzzy=False):
-    """Recursively merge new_items into base_items.
 
-    This search function will dive through most data structures and look
-    hte provided criteria. If the criteria is found the function will
-    return True otherwise it will return False.
+def _page(query):
+    """Return a Page from the limit and page_token query parameters.
 
-    :param data_structure: Data structure to search through.
-    :param criteria: Item to search for.
-    :param fuzzy: Enables or disables a fuzzy search.
-    :returns: ``bool``
+    :param query: Search parameters from the request
+    :type query: dict
+    :return: Page || None
     """
-    def _criteria_in_value(c, v):
-        if fuzzy:
-            try:
-                c = c.lower()
-                v = v.lower()
-                return c == v or c in v
-            except (TypeError, AttributeError):
-                pass
+    limit, token = search.page_params(query=query)
+    if limit:
+        return Page(size=limit, token=token)
+
+
+def _execute(cql, params, page=None):
+    """Execute a CQL string as a cached prepared statement.
+
+    When a page is provided only the rows of that page are fetched and the
+    paging state is stored within the page.
+
+    :param cql: CQL query string
+    :type cql: string
+    :param params: Bind parameters
+    :type params: list
+    :param page: Page of rows to return
+    :type page: object
+    :return: object
+    """
+    session = connection.get_session()
+    statement = SESSION_REGISTRY.prepare(cql=cql)
+    query_log = QueryLog.current()
+    trace = query_log is not None and query_log.trace
+    entry = None
+    if query_log is not None:
+        entry = query_log.statement(cql=cql, params=params)
+
+    with metrics.timer(stage='data_store'):
+        if page is None:
+            result = session.execute(statement, params, trace=trace)
         else:
-            return c == v
-
-    if isinstance(data_structure, (list, set, tuple)):
-        for item in data_structure:
-            if deep_search(data_structure=item, criteria=criteria, fuzzy=fuzzy):
-                return True
-    elif isinstance(data_structure, dict):
-        for key, value in data_structure.items():
-            if isinstance(value, (dict, list, set, tuple)):
-                if deep_search(data_structure=value, criteria=criteria, fuzzy=fuzzy):
-                    return True
-            elif not isinstance(value, int) and (',' in value or '\n' in value):
-                values = [i.lower() for i in re.split(',|\n', value) if i]
-                if deep_search(data_structure=values, criteria=criteria, fuzzy=fuzzy):
-                    return True
-            elif isinstance(value, int):
-                if criteria == value:
-                    return True
-            else:
-                if _criteria_in_value(c=criteria, v=value):
-                    return True
+            bound = statement.bind(params)
+            bound.fetch_size = page.size
+            result = session.execute(
+                bound,
+                paging_state=page.state,
+                trace=trace
+            )
+
+    if entry is not None:
+        query_log.executed(entry=entry, response=result if trace else None)
+    if page is None:
+        return result
+
+    page.set_state(state=result.paging_state)
+    return result.current_rows
+
+
+def _execute_async(cql, params):
+    """Start executing a CQL string as a cached prepared statement.
+
+    :param cql: CQL query string
+    :type cql: string
+    :param params: Bind parameters
+    :type params: list
+    :return: object
+    """
+    query_log = QueryLog.current()
+    trace = query_log is not None and query_log.trace
+    future = connection.get_session().execute_async(
+        SESSION_REGISTRY.prepare(cql=cql),
+        params,
+        trace=trace
+    )
+    if query_log is not None:
+        entry = query_log.statement(cql=cql, params=params)
+        if entry is not None:
+            def done(*args):
+                query_log.executed(
+                    entry=entry,
+                    response=future if trace else None
+                )
+            future.add_callbacks(callback=done, errback=done)
+    return future
+
+
+def _result(future):
+    """Wait for the rows of a statement started with _execute_async.
+
+    :param future: Response future
+    :type future: object
+    :return: object
+    """
+    with metrics.timer(stage='data_store'):
+        return future.result()
+
+
+def _execute_statements(statements, raise_on_first_error=True):
+    """Execute CQL strings as prepared statements concurrently.
+
+    The number of statements in flight is bounded by the write_concurrency
+    option.
+
+    :param statements: CQL query strings and bind parameters
+    :type statements: list
+    :param raise_on_first_error: Raise instead of returning failures
+    :type raise_on_first_error: bool
+    :return: list
+    """
+    if not statements:
+        return list()
+    with metrics.timer(stage='data_store'):
+        return concurrent.execute_concurrent(
+            session=connection.get_session(),
+            statements_and_parameters=[
+                (SESSION_REGISTRY.prepare(cql=cql), params)
+                for cql, params in statements
+            ],
+            concurrency=CONF['data_store']['write_concurrency'],
+            raise_on_first_error=raise_on_first_error
+        )
+
+
+def _to_database(model, args):
+    """Return a list of bind values converted using the model columns."""
+    return [model._columns[k].to_database(v) for k, v in args]
+
+
+def _from_database(model, row):
+    """Return a row dict with values converted using the model columns.
+
+    Rows read with prepared statements contain the raw driver values, an
+    empty collection for example is returned as None.
+    """
+    for k, v in row.items():
+        column = model._columns.get(k)
+        if column is not None:
+            row[k] = column.to_python(v)
     else:
-        if _criteria_in_value(c=criteria, v=data_structure):
-            return True
-    return False
+        return row
+
+
+def _select_statement(model, keys, columns=None, limit=None,
+                      allow_filtering=False):
+    """Return a SELECT statement and its bind parameters.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Column names and values to select rows by
+    :type keys: dict
+    :param columns: Column names to select, all columns when not set.
+    :type columns: list
+    :param limit: Maximum number of rows to return
+    :type limit: int
+    :param allow_filtering: Allow filtering on the selected columns.
+    :type allow_filtering: bool
+    :return: tuple
+    """
+    key_items = sorted(keys.items())
+    cql = 'SELECT %s FROM %s' % (
+        ', '.join(columns) if columns else '*',
+        _table(model=model)
+    )
+    if key_items:
+        cql += ' WHERE %s' % _where(keys=[k for k, _ in key_items])
+    if limit:
+        cql += ' LIMIT %d' % limit
+    if allow_filtering:
+        cql += ' ALLOW FILTERING'
+    return cql, _to_database(model=model, args=key_items)
+
+
+def _select(model, keys, columns=None, limit=None, allow_filtering=False,
+            page=None):
+    """Return rows using a prepared statement.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Column names and values to select rows by
+    :type keys: dict
+    :param columns: Column names to select, all columns when not set.
+    :type columns: list
+    :param limit: Maximum number of rows to return
+    :type limit: int
+    :param allow_filtering: Allow filtering on the selected columns.
+    :type allow_filtering: bool
+    :param page: Page of rows to return
+    :type page: object
+    :return: object
+    """
+    cql, params = _select_statement(
+        model=model,
+        keys=keys,
+        columns=columns,
+        limit=limit,
+        allow_filtering=allow_filtering
+    )
+    return _execute(cql=cql, params=params, page=page)
+
+
+def _select_one(model, keys, columns=None):
+    """Return a single row from a primary key lookup or None."""
+    for row in _select(model=model, keys=keys, columns=columns, limit=1):
+        return row
+
+
+def _exists(model, **keys):
+    """Return True if a row exists for the given primary key values."""
+    return _select_one(
+        model=model,
+        keys=keys,
+        columns=list(model._primary_keys.keys())[:1]
+    ) is not None
+
+
+CACHES = dict()
+
 
+def _cache(name):
+    """Return a process wide cache sized by the [data_store] options.
 
-def _search(self, q, search_items, lookup_params, fuzzy):
-    """Search query results."""
-    q_list = list()
-    for k, v in search_items:
-        if v:
-            lookup_params[k] = v
+    :param name: Cache name, used as the option prefix
+    :type name: string
+    :return: object
+    """
+    named_cache = CACHES.get(name)
+    if named_cache is None:
+        data_store = CONF['data_store']
+        named_cache = CACHES[name] = cache.TTLCache(
+            maxsize=data_store['%s_cache_size' % name],
+            ttl=data_store['%s_cache_ttl' % name]
+        )
+    return named_cache
+
+
+def cache_stats():
+    """Return the size, hits and misses of the driver caches.
+
+    :return: dict
+    """
+    return dict([(k, v.stats()) for k, v in CACHES.items()])
+
+
+def _cache_key(model, keys):
+    """Return a cache key for the primary key values of a row."""
+    return (model._raw_column_family_name(),) + tuple(sorted(keys.items()))
+
+
+def _parents_missing(ent_id, env_id=None):
+    """Return the error of a missing parent, None when the parents exist.
+
+    Parents which are not within the existence cache are read concurrently.
+    Only parents found to exist are cached, a missing parent is looked up
+    again on the next request.
 
-    all_list = [convert_from_json(q_got=dict(i)) for i in q.all()]
-    for item in all_list:
-        if not lookup_params:
-            q_list.append(self._friendly_return(item))
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :return: dict, int || None
+    """
+    parents = list()
+    if env_id:
+        parents.append(
+            (models.Environments, {'ent_id': ent_id, 'env_id': env_id})
+        )
+    parents.append((models.Entities, {'ent_id': ent_id}))
+
+    exists_cache = _cache(name='exists')
+    reads = list()
+    for model, keys in parents:
+        key = _cache_key(model=model, keys=keys)
+        if exists_cache.get(key):
             continue
+        cql, params = _select_statement(
+            model=model,
+            keys=keys,
+            columns=list(model._primary_keys.keys())[:1],
+            limit=1
+        )
+        reads.append((model, key, _execute_async(cql=cql, params=params)))
+
+    missing = set()
+    for model, key, future in reads:
+        if list(_result(future=future)):
+            exists_cache.set(key, True)
+        else:
+            missing.add(model)
+
+    if models.Environments in missing:
+        LOG.warn('Environment [ %s ] was not found', env_id)
+        return {'ERROR': 'Environment [%s] was not found' % env_id}, 412
+
+    if models.Entities in missing:
+        LOG.critical('Entity [ %s ] was not found', ent_id)
+        return {'ERROR': 'Entity [%s] was not found' % ent_id}, 412
 
-        for k, v in lookup_params.items():
-            q_item = item.get(k)
-            if q_item:
-                if deep_search(data_structure=q_item, criteria=v, fuzzy=fuzzy):
-                    q_list.append(self._friendly_return(item))
+
+def _resolve_lookup(model, key_rows, key_filter, columns=None):
+    """Return the rows of a model for the primary keys in a lookup table.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param key_rows: Rows containing the primary key values
+    :type key_rows: list
+    :param key_filter: Column names and values the rows must match
+    :type key_filter: list
+    :param columns: Column names to select, all columns when not set.
+    :type columns: list
+    :return: generator
+    """
+    primary_keys = list(model._primary_keys.keys())
+    cql = 'SELECT %s FROM %s WHERE %s' % (
+        ', '.join(columns) if columns else '*',
+        _table(model=model),
+        _where(keys=primary_keys)
+    )
+    parameters = [
+        _to_database(model=model, args=[(k, i[k]) for k in primary_keys])
+        for i in key_rows
+    ]
+    query_log = QueryLog.current()
+    trace = query_log is not None and query_log.trace
+    entry = None
+    if query_log is not None:
+        entry = query_log.statement(
+            cql=cql,
+            params=parameters[:1],
+            executions=len(parameters)
+        )
+    session = connection.get_session()
+    statement = SESSION_REGISTRY.prepare(cql=cql)
+    parameters = iter(parameters)
+    futures = collections.deque()
+    traced = None
+    try:
+        while True:
+            # Keep at most lookup_concurrency statements in flight and
+            # return the rows in the order of the lookup rows. Only the
+            # first statement is traced, a single primary key read is
+            # representative of the others.
+            while len(futures) < CONF['data_store']['lookup_concurrency']:
+                params = next(parameters, None)
+                if params is None:
                     break
+                futures.append(
+                    session.execute_async(
+                        statement,
+                        params,
+                        trace=trace and traced is None
+                    )
+                )
+                if trace and traced is None:
+                    traced = futures[-1]
+            if not futures:
+                break
+            for row in _result(future=futures.popleft()):
+                if all([row.get(k) == v for k, v in key_filter]):
+                    yield row
+    finally:
+        # Also recorded when the caller stops reading early.
+        if entry is not None:
+            query_log.executed(entry=entry, response=traced)
+
+
+def _select_by_lookup(query_plan, page=None, columns=None):
+    """Return rows whose primary keys are resolved through a lookup table.
+
+    Lookup tables include the tag index tables. The lookup table is read
+    right away, the rows it references are read
+    while the returned generator is consumed.
+
+    :param query_plan: Query plan using the lookup access path
+    :type query_plan: object
+    :param page: Page of the lookup table to resolve
+    :type page: object
+    :param columns: Column names to select, all columns when not set.
+    :type columns: list
+    :return: generator
+    """
+    model = query_plan.model
+    lookup = query_plan.lookup
+    primary_keys = list(model._primary_keys.keys())
+    known_keys = dict(query_plan.keys)
+    if query_plan.index:
+        known_keys[query_plan.index[0]] = query_plan.index[1]
+    key_rows = _select(
+        model=lookup,
+        keys=dict([(k, known_keys[k]) for k in lookup._partition_keys]),
+        columns=primary_keys,
+        page=page
+    )
+
+    # Any other known key is used to filter the resolved rows.
+    return _resolve_lookup(
+        model=model,
+        key_rows=key_rows,
+        key_filter=[
+            (k, v) for k, v in query_plan.keys.items() if k not in primary_keys
+        ],
+        columns=columns
+    )
+
+
+def _with_links(row, child_key, future):
+    """Set the links of a row from the lookup table rows of its children.
+
+    Rows written before the lookup table held the links keep the links
+    stored within them.
+    """
+    stored = row.get('links') or dict()
+    links = dict()
+    for child in _result(future=future):
+        link = child['link'] or stored.get(child[child_key])
+        if link:
+            links[child[child_key]] = link
+    row['links'] = links
+    return row
+
+
+def _read_links(model, rows):
+    """Return rows with the links to their children.
+
+    The links are read from the lookup table of the children, for up to
+    lookup_concurrency rows at once while the returned generator is
+    consumed. Rows without children are returned as they are.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param rows: Rows of the model
+    :type rows: generator
+    :return: generator
+    """
+    child_model = models.CHILD_MODELS.get(model)
+    if child_model is None:
+        return rows
+
+    lookup = models.LOOKUP_MODELS[child_model]
+    partition_keys = list(lookup._partition_keys.keys())
+    child_key = [
+        k for k in lookup._primary_keys.keys() if k not in partition_keys
+    ][0]
+    cql = 'SELECT %s, link FROM %s WHERE %s' % (
+        child_key,
+        _table(model=lookup),
+        _where(keys=partition_keys)
+    )
+
+    def read():
+        concurrency = CONF['data_store']['lookup_concurrency']
+        pending = collections.deque()
+        for row in rows:
+            future = _execute_async(
+                cql=cql,
+                params=_to_database(
+                    model=lookup,
+                    args=[(k, row[k]) for k in partition_keys]
+                )
+            )
+            pending.append((row, future))
+            while len(pending) >= max(concurrency, 1):
+                row, future = pending.popleft()
+                yield _with_links(row=row, child_key=child_key, future=future)
+        while pending:
+            row, future = pending.popleft()
+            yield _with_links(row=row, child_key=child_key, future=future)
+    return read()
+
+
+def _run_plan(query_plan, page=None, columns=None):
+    """Return the rows for a query plan.
+
+    The first query is executed before returning, so a page token is set
+    and errors are raised, while further rows are fetched as the returned
+    generator is consumed. The links of a row are only read when all
+    columns or the links are selected.
+
+    :param query_plan: Query plan
+    :type query_plan: object
+    :param page: Page of rows to return
+    :type page: object
+    :param columns: Column names to select, all columns when not set.
+    :type columns: list
+    :return: generator
+    """
+    model = query_plan.model
+    if query_plan.path == planner.PRIMARY_KEY:
+        rows = _select(
+            model=model,
+            keys=query_plan.keys,
+            columns=columns,
+            limit=1
+        )
+    elif query_plan.path == planner.PARTITION:
+        rows = _select(
+            model=model,
+            keys=query_plan.keys,
+            columns=columns,
+            allow_filtering=True,
+            page=page
+        )
+    elif query_plan.path in (planner.TAG, planner.LOOKUP):
+        rows = _select_by_lookup(
+            query_plan=query_plan,
+            page=page,
+            columns=columns
+        )
     else:
-        return q_list
+        keys = dict(query_plan.keys)
+        if query_plan.path == planner.INDEX:
+            name, value = query_plan.index
+            keys[name] = value
+        elif keys:
+            LOG.warn('Running a filtered table scan: %s', query_plan)
+        else:
+            LOG.info('Running a table scan: %s', query_plan)
+        rows = _select(
+            model=model,
+            keys=keys,
+            columns=columns,
+            allow_filtering=len(keys) > 1 or query_plan.path == planner.SCAN,
+            page=page
+        )
+
+    rows = (_from_database(model=model, row=row) for row in rows)
+    if columns is None or 'links' in columns:
+        rows = _read_links(model=model, rows=rows)
+    # Further pages and rows resolved through lookups are read as the rows
+    #  are consumed.
+    return metrics.timed(stage='data_store', items=rows)
 
 
-def _get_search(self, model, ent_id=None, env_id=None, dev_id=None):
+def _get_search(self, model, ent_id=None, env_id=None, dev_id=None,
+                stream=False, scan_all=False):
     """Retrieve a list of entities.
 
+    A scan which isn't paged by the request returns its first scan_limit
+    rows and sets the page token of the rest, so a listing is never cut
+    short without the client knowing.
+
     :param self: Class object
     :type self: object || query
     :param model: DB Model object
@@ -176,42 +1012,16 @@ def _get_search(self, model, ent_id=None, env_id=None, dev_id=None):
     :type env_id: string
     :param dev_id: Device ID
     :type dev_id: string
-    :return: list
+    :param stream: Return a generator which reads rows as it is consumed.
+    :type stream: bool
+    :param scan_all: Read every row of a scan, such as to count them.
+    :type scan_all: bool
+    :return: list || generator
     """
 
-    def run_query():
-        if lookup_params:
-            if fuzzy:
-                return model.objects.filter(**lookup_params).allow_filtering()
-            else:
-                return model.objects.filter(**lookup_params).allow_filtering()
-        else:
-            return model.objects()
-
     # This creates a single use search criteria hash which is used to look
     #  inside a list or other hashable type.
-    search_dict = {
-        'tag': {
-            'opt': self.query.pop('tag', None),
-            'parent': 'tags'
-        },
-        'port': {
-            'opt': self.query.pop('port', None),
-            'parent': 'ports'
-        },
-        'var': {
-            'opt': self.query.pop('var', None),
-            'parent': 'vars'
-        },
-        'link': {
-            'opt': self.query.pop('link', None),
-            'parent': 'links'
-        },
-        'contact': {
-            'opt': self.query.pop('contact', None),
-            'parent': 'contacts'
-        }
-    }
+    search_dict = search.search_items(query=self.query)
 
     lookup_params = dict()
     if ent_id:
@@ -222,25 +1032,57 @@ def _get_search(self, model, ent_id=None, env_id=None, dev_id=None):
         lookup_params['dev_id'] = dev_id
 
     fuzzy = self.query.pop('fuzzy', False)
+    page = _page(query=self.query)
+    fields = search.fields_param(query=self.query, columns=model._columns)
+    columns = search.select_columns(
+        fields=fields,
+        primary_keys=list(model._primary_keys),
+        criteria=[
+            k for k in list(search_dict) + list(self.query)
+            if k in model._columns
+        ]
+    )
+    query_plan = self.query_plan = planner.plan(
+        model=model,
+        keys=lookup_params,
+        query=self.query,
+        fuzzy=fuzzy,
+        tag=search_dict.get('tags')
+    )
+    LOG.debug('Query plan: %s', query_plan)
+    scan_limit = CONF['data_store']['scan_limit']
+    scanned = query_plan.path in (planner.INDEX, planner.SCAN)
+    if page is None and scanned and scan_limit and not scan_all:
+        page = Page(size=scan_limit)
+    query_log = QueryLog(query_plan=query_plan)
     try:
-        q = run_query()
+        with query_log:
+            rows = _run_plan(query_plan=query_plan, page=page, columns=columns)
+        results = query_log.returned(
+            items=search.search(
+                self=self,
+                q=query_log.fetched(rows=rows),
+                search_items=search_dict.items(),
+                lookup_params=self.query,
+                fuzzy=fuzzy,
+                fields=fields
+            )
+        )
+        if not stream:
+            results = list(results)
     except Exception as exp:
+        # The search, with the statements executed, is within the slow
+        #  query log.
+        query_log.finish(error=exp)
         LOG.warn(exps.log_exception(exp))
         return list()
     else:
-        return _search(
-            self=self,
-            q=q,
-            search_items=[
-                (v['parent'], v['opt']) for k, v in search_dict.items()
-                if v['opt']
-            ],
-            lookup_params=self.query,
-            fuzzy=fuzzy
-        )
+        if page is not None:
+            self.next_page_token = page.next_token
+        return results
 
 
-def get_device(self, ent_id, env_id, dev_id=None):
+def get_device(self, ent_id, env_id, dev_id=None, stream=False):
     """Retrieve a list of entities.
 
     :param self: Class object
@@ -251,18 +1093,46 @@ def get_device(self, ent_id, env_id, dev_id=None):
     :type env_id: string
     :param dev_id: Device ID
     :type dev_id: string
-    :return: list
+    :param stream: Return a generator instead of a list
+    :type stream: bool
+    :return: list || generator
     """
     return _get_search(
         self=self,
         model=models.Devices,
         ent_id=ent_id,
         env_id=env_id,
-        dev_id=dev_id
+        dev_id=dev_id,
+        stream=stream
     )
 
 
-def get_environment(self, ent_id, env_id=None):
+def get_device_vars(self, ent_id, env_id, dev_id):
+    """Return the variables of a device, None if it does not exist.
+
+    Only the vars column is read, by primary key.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param dev_id: Device ID
+    :type dev_id: string
+    :return: Mapping || None
+    """
+    row = _select_one(
+        model=models.Devices,
+        keys={'ent_id': ent_id, 'env_id': env_id, 'dev_id': dev_id},
+        columns=['vars']
+    )
+    if row is not None:
+        row = _from_database(model=models.Devices, row=dict(row))
+        return search.convert_from_json(q_got=row)['vars']
+
+
+def get_environment(self, ent_id, env_id=None, stream=False):
     """Retrieve a list of entities.
 
     :param self: Class object
@@ -271,109 +1141,505 @@ def get_environment(self, ent_id, env_id=None):
     :type ent_id: string
     :param env_id: Environment ID
     :type env_id: string
-    :return: list
+    :param stream: Return a generator instead of a list
+    :type stream: bool
+    :return: list || generator
     """
     return _get_search(
         self=self,
         model=models.Environments,
         ent_id=ent_id,
-        env_id=env_id
+        env_id=env_id,
+        stream=stream
     )
 
 
-def get_entity(self, ent_id):
+def get_entity(self, ent_id, stream=False):
     """Retrieve a list of entities.
 
     :param self: Class object
     :type self: object || query
     :param ent_id: Entity ID
     :type ent_id: string
-    :return: list
+    :param stream: Return a generator instead of a list
+    :type stream: bool
+    :return: list || generator
     """
     return _get_search(
         self=self,
         model=models.Entities,
-        ent_id=ent_id
+        ent_id=ent_id,
+        stream=stream
     )
 
 
-def _put_item(args, query, ent_id=None, env_id=None, dev_id=None, update=False):
-    """PUT an item.
+def updated_at(model, **keys):
+    """Return when a row was last updated, None if it does not exist.
 
-    :param ent_id: Entity ID
-    :type ent_id: string
-    :param env_id: Environment ID
-    :type env_id: string
-    :param dev_id: Device ID
-    :type dev_id: string
+    Writing a child doesn't update its parent, so for rows with children
+    the number of children counted is returned with the time, read
+    concurrently, as a new child adds a link to the row.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :return: datetime || tuple || None
+    """
+    cql, params = _select_statement(
+        model=model,
+        keys=keys,
+        columns=['updated_at'],
+        limit=1
+    )
+    row_future = _execute_async(cql=cql, params=params)
+    child_model = models.CHILD_MODELS.get(model)
+    if child_model is not None:
+        cql, params = _select_statement(
+            model=models.RowCounts,
+            keys=models.count_keys(model=child_model, keys=keys),
+            columns=['total']
+        )
+        count_future = _execute_async(cql=cql, params=params)
+
+    for row in _result(future=row_future):
+        if child_model is None:
+            return row['updated_at']
+        for count in _result(future=count_future):
+            return row['updated_at'], count['total']
+        return row['updated_at'], 0
+
+
+def _missing_required(model, values):
+    """Return the names of the required columns without a value."""
+    return sorted([
+        k for k, v in model._columns.items()
+        if v.required and values.get(k) is None
+    ])
+
+
+def _item_statement(model, args, keys, update=False):
+    """Return the statement writing an item.
+
+    New rows are written with an INSERT, existing rows with an UPDATE. Map
+    and set columns are appended to on update, the tags of a row are merged
+    by the data store rather than read and merged here.
+
+    :param model: DB Model object
+    :type model: object || query
     :param args: Dictionary arguments
     :type args: dict
-    :return: dict
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :param update: Update an existing row
+    :type update: bool
+    :return: dict, tuple
     """
-    for k, v in args.get('vars', {}).items():
-        if isinstance(v, (dict, list)):
-            args['vars'][k] = json.dumps(v)
+    if args.get('vars'):
+        args['vars'] = variables.encode_vars(
+            variables=args['vars'],
+            binary=isinstance(
+                model._columns['vars'].value_col,
+                cql_columns.Blob
+            )
+        )
 
     args['updated_at'] = datetime.datetime.utcnow()
+    # Tokens are appended to on update, a created row holds all of them.
+    tokens = search.search_tokens(args=args, complete=not update)
+    table = _table(model=model)
+    key_items = sorted(keys.items())
     if update:
-        query.update(**args)
+        items = [
+            (k, v) for k, v in sorted(args.items())
+            if k in model._columns and k not in model._primary_keys
+        ]
+        if tokens:
+            items.append((search.TOKENS_COLUMN, tokens))
+        appended = (cql_columns.Map, cql_columns.Set)
+        set_clause = list()
+        for k, _ in items:
+            if isinstance(model._columns[k], appended):
+                set_clause.append('%s = %s + ?' % (k, k))
+            else:
+                set_clause.append('%s = ?' % k)
+        cql = 'UPDATE %s SET %s WHERE %s' % (
+            table,
+            ', '.join(set_clause),
+            _where(keys=[k for k, _ in key_items])
+        )
+        params = _to_database(model=model, args=items + key_items)
     else:
         args['created_at'] = args['updated_at']
-        if ent_id:
-            args['ent_id'] = ent_id
-        if env_id:
-            args['env_id'] = env_id
-        if dev_id:
-            args['dev_id'] = dev_id
-        query.create(**args)
-    return args
+        args.update(keys)
+        values = dict([(k, v) for k, v in args.items() if k in model._columns])
+        values.setdefault('id', uuid.uuid4())
+        if tokens:
+            values[search.TOKENS_COLUMN] = tokens
+        missing = _missing_required(model=model, values=values)
+        if missing:
+            raise ValidationError(
+                'Required fields are missing: %s' % ', '.join(missing)
+            )
+        items = sorted(values.items())
+        cql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            table,
+            ', '.join([k for k, _ in items]),
+            ', '.join(['?'] * len(items))
+        )
+        params = _to_database(model=model, args=items)
+    return search.convert_from_json(q_got=args), (cql, params)
 
 
-def _update_tags(query, args):
-    """Coalesce tags
+def _write_rows(model, rows):
+    """Write rows, reading only the rows not known to exist.
 
-    :param query: Class object
-    :type query: object || query
-    :param args: Dictionary arguments
-    :type args: dict
-    :return:
+    Rows this process knows to exist are written with an UPDATE right away.
+    Whether the other rows exist is read by primary key, concurrently, and
+    only existing rows are updated. An UPDATE appends to the map and set
+    columns, so the tags of a row are merged by the data store. New rows
+    are written with an INSERT setting created_at and id. A new row missing
+    required columns is rejected. All rows are written concurrently, with
+    plain writes rather than lightweight transactions.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param rows: Dictionary arguments and primary keys of the rows
+    :type rows: list
+    :return: list of dict, bool (update), exception tuples
     """
-    try:
-        r_dev = query.get()
-        args['tags'] = set(list(r_dev['tags']) + list(args.pop('tags', list())))
-    except Exception as exp:
-        LOG.warn(exps.log_exception(exp))
-        return args, False
-    else:
-        return args, True
+    rows_cache = _cache(name='exists')
+    results = [None] * len(rows)
+    exists = [False] * len(rows)
+    reads = list()
+    for index, (_, keys) in enumerate(rows):
+        if rows_cache.get(_cache_key(model=model, keys=keys)):
+            exists[index] = True
+        else:
+            reads.append((index, _select_statement(
+                model=model,
+                keys=keys,
+                columns=list(model._primary_keys.keys())[:1],
+                limit=1
+            )))
+
+    read = _execute_statements(
+        statements=[i[-1] for i in reads],
+        raise_on_first_error=False
+    )
+    for (index, _), (success, result) in zip(reads, read):
+        if success:
+            exists[index] = bool(list(result))
+        else:
+            results[index] = (rows[index][0], False, result)
+
+    writes = list()
+    for index, (args, keys) in enumerate(rows):
+        if results[index] is not None:
+            continue
+        try:
+            args, statement = _item_statement(
+                model=model,
+                args=args,
+                keys=keys,
+                update=exists[index]
+            )
+        except Exception as exp:
+            results[index] = (args, False, exp)
+        else:
+            writes.append((index, args, statement))
+
+    written = _execute_statements(
+        statements=[i[-1] for i in writes],
+        raise_on_first_error=False
+    )
+    for (index, args, _), (success, result) in zip(writes, written):
+        results[index] = (args, exists[index], None if success else result)
+
+    for (_, keys), (_, _, exp) in zip(rows, results):
+        if exp is None:
+            rows_cache.set(_cache_key(model=model, keys=keys), True)
+    return results
+
 
+def _put_item(model, args, keys, statements=None):
+    """PUT an item.
 
-def _put_links(end_q, endpoint, end_id, args, cluster_keys):
-    """PUT Links back.
+    Statements which depend on the item, such as its lookup table rows,
+    are only issued once the item was written, so a rejected or failed
+    write leaves no lookup or tag index row behind. They are issued
+    concurrently with the row count updates of a created item.
 
-    :param end_q: Class object
-    :type end_q: object || query
-    :param endpoint: Environment ID
-    :type endpoint: string
-    :param end_id: Entity ID
-    :type end_id: string
+    :param model: DB Model object
+    :type model: object || query
     :param args: Dictionary arguments
     :type args: dict
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :param statements: CQL query strings and bind parameters
+    :type statements: list
+    :return: dict, bool
     """
-    # Post back a link within the entity to the new environment
-    # links = end_q.get('links')
-    links = {}
+    args, update, exp = _write_rows(
+        model=model,
+        rows=[(args, keys)]
+    )[0]
+    if exp is not None:
+        raise exp
+
+    statements = list(statements or list())
+    if not update:
+        statements.extend(_count_statements(model=model, keys=keys))
+    for success, result in _execute_statements(
+            statements=statements, raise_on_first_error=False):
+        if not success:
+            raise result
+    return args, update
+
+
+def _lookup_statements(model, keys, link=None):
+    """Return the statements writing the lookup table row of a row.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :param link: Link from the parent to the row
+    :type link: string
+    :return: list
+    """
+    lookup = models.LOOKUP_MODELS.get(model)
+    if lookup is None:
+        return list()
+
+    items = [(k, keys[k]) for k in lookup._primary_keys.keys()]
+    if link:
+        items.append(('link', link))
+    items.sort()
+    cql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        _table(model=lookup),
+        ', '.join([k for k, _ in items]),
+        ', '.join(['?'] * len(items))
+    )
+    return [(cql, _to_database(model=lookup, args=items))]
+
+
+def _count_statement(model, keys, value=1, column='total'):
+    """Return the statement incrementing the row count of a table.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Key column names and values
+    :type keys: dict
+    :param value: Number to add to the count
+    :type value: int
+    :param column: Counter column incremented, total or seeded
+    :type column: string
+    :return: tuple
+    """
+    count_keys = sorted(models.count_keys(model=model, keys=keys).items())
+    cql = 'UPDATE %s SET %s = %s + ? WHERE %s' % (
+        _table(model=models.RowCounts),
+        column,
+        column,
+        _where(keys=[k for k, _ in count_keys])
+    )
+    return cql, [value] + [v for _, v in count_keys]
+
+
+def _count_statements(model, keys, value=1):
+    """Return the statements counting rows created within a table.
+
+    A created row has no children yet, so the row counts of its children
+    are seeded along with it.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Key column names and values
+    :type keys: dict
+    :param value: Number of rows created
+    :type value: int
+    :return: list
+    """
+    statements = [_count_statement(model=model, keys=keys, value=value)]
+    child_model = models.CHILD_MODELS.get(model)
+    if child_model is not None:
+        statements.append(_count_statement(
+            model=child_model,
+            keys=keys,
+            column='seeded'
+        ))
+    return statements
+
+
+def _count_rows(model, keys):
+    """Return the number of rows counted within the data store.
+
+    Rows are counted from the lookup table when one can be used so the
+    rows themselves are not read.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Key column names and values
+    :type keys: dict
+    :return: int
+    """
+    lookup = models.LOOKUP_MODELS.get(model)
+    if lookup is not None:
+        model = lookup
+        keys = dict([(k, keys[k]) for k in lookup._partition_keys.keys()])
+    row = _select_one(model=model, keys=keys, columns=['COUNT(*)'])
+    return row['count']
+
+
+def _count(self, model, exact=False, **keys):
+    """Return the number of rows of a model.
+
+    The count is read from the row counts kept on write. When the count
+    has to be exact, when search criteria was provided or when the kept
+    count hasn't been seeded, such as for rows stored before counts were
+    kept, the rows are counted instead. A recount doesn't write the kept
+    count, rows created while counting would be counted twice, the counts
+    are seeded by rebuild_lookups.
+
+    :param self: Class object
+    :type self: object || query
+    :param model: DB Model object
+    :type model: object || query
+    :param exact: Recount the rows
+    :type exact: bool
+    :param keys: Key column names and values
+    :type keys: dict
+    :return: int
+    """
+    if self.query:
+        return sum([
+            1 for _ in _get_search(
+                self,
+                model,
+                stream=True,
+                scan_all=True,
+                **keys
+            )
+        ])
+
+    if not exact:
+        kept = _select_one(
+            model=models.RowCounts,
+            keys=models.count_keys(model=model, keys=keys),
+            columns=['total', 'seeded']
+        )
+        if kept and kept['seeded']:
+            return kept['total'] or 0
+
+    return _count_rows(model=model, keys=keys)
+
+
+def count_device(self, ent_id, env_id, exact=False):
+    """Return the number of devices within an environment.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param exact: Recount the devices
+    :type exact: bool
+    :return: int
+    """
+    return _count(
+        self=self,
+        model=models.Devices,
+        exact=exact,
+        ent_id=ent_id,
+        env_id=env_id
+    )
+
+
+def count_environment(self, ent_id, exact=False):
+    """Return the number of environments within an entity.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param exact: Recount the environments
+    :type exact: bool
+    :return: int
+    """
+    return _count(
+        self=self,
+        model=models.Environments,
+        exact=exact,
+        ent_id=ent_id
+    )
+
+
+def count_entity(self, exact=False):
+    """Return the number of entities.
+
+    :param self: Class object
+    :type self: object || query
+    :param exact: Recount the entities
+    :type exact: bool
+    :return: int
+    """
+    return _count(
+        self=self,
+        model=models.Entities,
+        exact=exact
+    )
+
+
+def _tag_index_statements(model, keys, tags):
+    """Return the statements adding the tags written to the tag index.
+
+    The index is only appended to. Tags are merged into a row on write, and
+    a tag search matches the tags of the rows read through the index, so an
+    entry whose tag the row no longer holds is filtered out on read.
+
+    :param model: DB Model object
+    :type model: object || query
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :param tags: Tags written to the row
+    :type tags: set
+    :return: list
+    """
+    tag_model = models.TAG_MODELS.get(model)
+    if tag_model is None:
+        return list()
+
+    tags = set(tags or list())
+    key_items = sorted(
+        [(k, keys[k]) for k in tag_model._primary_keys.keys() if k != 'tag']
+    )
+    key_names = [k for k, _ in key_items]
+    key_values = _to_database(model=tag_model, args=key_items)
+    insert = 'INSERT INTO %s (tag, %s) VALUES (?, %s)' % (
+        _table(model=tag_model),
+        ', '.join(key_names),
+        ', '.join(['?'] * len(key_names))
+    )
+    return [(insert, [tag] + key_values) for tag in sorted(tags)]
+
+
+def _link(endpoint, end_id):
+    """Return the link to a child from the endpoint it was written to."""
     if endpoint.endswith(end_id):
-        links[end_id] = endpoint
+        return endpoint
     else:
-        links[end_id] = '%s/%s' % (endpoint, end_id)
-
-    end_q(**cluster_keys).update(**{'links': links, 'updated_at': args['updated_at']})
+        return '%s/%s' % (endpoint, end_id)
 
 
 def put_device(self, ent_id, env_id, dev_id, args):
     """PUT an entity.
 
+    The parents are checked concurrently. The lookup, tag index, link and
+    row count updates of the device are issued concurrently once the
+    device itself has been written.
+
     :param self: Class object
     :type self: object || query
     :param ent_id: Entity ID
@@ -386,58 +1652,113 @@ def put_device(self, ent_id, env_id, dev_id, args):
     :type args: dict
     :return: string, int
     """
-    try:
-        q_env = models.Environments.objects(
-            env_id=env_id
-        ).limit(1)
-        q_env.get()
-    except models.Environments.DoesNotExist as exp:
-        LOG.warn(exps.log_exception(exp))
-        return {'ERROR': 'Environment [%s] was not found' % env_id}, 412
-
-    try:
-        q_ent = models.Entities.objects(
-            ent_id=ent_id
-        ).limit(1)
-        q_ent.get()
-    except models.Entities.DoesNotExist as exp:
-        LOG.critical(exps.log_exception(exp))
-        return {'ERROR': 'Entity [%s] was not found' % ent_id}, 412
-
-    q_dev = models.Devices.objects(
-        env_id=env_id,
-        ent_id=ent_id,
-        dev_id=dev_id
-    ).limit(1)
-
-    args, update = _update_tags(
-        query=q_dev,
-        args=args
-    )
+    missing = _parents_missing(ent_id=ent_id, env_id=env_id)
+    if missing:
+        return missing
 
+    dev_keys = {'env_id': env_id, 'ent_id': ent_id, 'dev_id': dev_id}
     try:
-        # Write data to the backend
-        args = _put_item(
-            args=self.convert(args),
-            query=q_dev,
-            ent_id=ent_id,
-            env_id=env_id,
-            dev_id=dev_id,
-            update=update
+        args = self.convert(args)
+        statements = _lookup_statements(
+            model=models.Devices,
+            keys=dev_keys,
+            link=_link(endpoint=self.endpoint, end_id=dev_id)
         )
-
-        _put_links(
-            end_q=q_env,
-            endpoint=self.endpoint,
-            end_id=dev_id,
+        statements.extend(_tag_index_statements(
+            model=models.Devices,
+            keys=dev_keys,
+            tags=args.get('tags')
+        ))
+        # Write data to the backend
+        args, _ = _put_item(
+            model=models.Devices,
             args=args,
-            cluster_keys={'ent_id': ent_id}
+            keys=dev_keys,
+            statements=statements
         )
     except Exception as exp:
         LOG.critical(exps.log_exception(exp))
         return {'ERROR': str(exp)}, 400
     else:
-        return self._friendly_return(args), 200
+        return args, 200
+
+
+def put_devices(self, ent_id, env_id, items):
+    """PUT many devices at once.
+
+    The parent environment and entity are checked once. All devices are
+    written concurrently, then the lookup, tag index and count updates of
+    the written devices are issued concurrently. The links to the devices
+    are written to their lookup table rows, spread across the cluster by
+    device rather than written to the environment row.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param items: Device IDs and their dictionary arguments
+    :type items: list
+    :return: list, int
+    """
+    missing = _parents_missing(ent_id=ent_id, env_id=env_id)
+    if missing:
+        return missing
+
+    env_keys = {'env_id': env_id, 'ent_id': ent_id}
+    dev_keys = [
+        {'env_id': env_id, 'ent_id': ent_id, 'dev_id': dev_id}
+        for dev_id, _ in items
+    ]
+    written = _write_rows(
+        model=models.Devices,
+        rows=[
+            (self.convert(args), keys)
+            for (_, args), keys in zip(items, dev_keys)
+        ]
+    )
+
+    returns = list()
+    created = 0
+    updates = list()
+    for (dev_id, _), keys, (args, update, exp) in zip(
+            items, dev_keys, written):
+        if exp is not None:
+            LOG.critical(exps.log_exception(exp))
+            returns.append({'dev_id': dev_id, 'ERROR': str(exp)})
+            continue
+
+        returns.append(args)
+        if not update:
+            created += 1
+        updates.extend(_lookup_statements(
+            model=models.Devices,
+            keys=keys,
+            link=_link(endpoint=self.endpoint, end_id=dev_id)
+        ))
+        updates.extend(_tag_index_statements(
+            model=models.Devices,
+            keys=keys,
+            tags=args.get('tags')
+        ))
+
+    if created:
+        updates.extend(_count_statements(
+            model=models.Devices,
+            keys=env_keys,
+            value=created
+        ))
+
+    for success, result in _execute_statements(
+            statements=updates, raise_on_first_error=False):
+        if not success:
+            LOG.critical(exps.log_exception(result))
+
+    if any(['ERROR' in i for i in returns]):
+        return returns, 207
+    else:
+        return returns, 200
 
 
 def put_environment(self, ent_id, env_id, args):
@@ -453,47 +1774,34 @@ def put_environment(self, ent_id, env_id, args):
     :type args: dict
     :return: string, int
     """
-    try:
-        q_ent = models.Entities.objects(
-            ent_id=ent_id
-        ).limit(1)
-        q_ent.get()
-    except models.Entities.DoesNotExist as exp:
-        LOG.critical(exps.log_exception(exp))
-        return {'ERROR': 'Entity [%s] was not found' % ent_id}, 412
-
-    q_env = models.Environments.objects(
-        env_id=env_id,
-        ent_id=ent_id
-    ).limit(1)
-
-    args, update = _update_tags(
-        query=q_env,
-        args=args
-    )
+    missing = _parents_missing(ent_id=ent_id)
+    if missing:
+        return missing
 
+    env_keys = {'env_id': env_id, 'ent_id': ent_id}
     try:
-        # Write data to the backend
-        args = _put_item(
-            args=args,
-            query=q_env,
-            ent_id=ent_id,
-            env_id=env_id,
-            update=update
+        statements = _lookup_statements(
+            model=models.Environments,
+            keys=env_keys,
+            link=_link(endpoint=self.endpoint, end_id=env_id)
         )
-
-        _put_links(
-            end_q=q_ent,
-            endpoint=self.endpoint,
-            end_id=env_id,
+        statements.extend(_tag_index_statements(
+            model=models.Environments,
+            keys=env_keys,
+            tags=args.get('tags')
+        ))
+        # Write data to the backend
+        args, _ = _put_item(
+            model=models.Environments,
             args=args,
-            cluster_keys={}
+            keys=env_keys,
+            statements=statements
         )
     except Exception as exp:
         LOG.critical(exps.log_exception(exp))
         return {'ERROR': str(exp)}, 400
     else:
-        return self._friendly_return(args), 200
+        return args, 200
 
 
 def put_entity(self, ent_id, args):
@@ -506,25 +1814,21 @@ def put_entity(self, ent_id, args):
     :type ent_id: dict
     :return: string, int
     """
-    q_ent = models.Entities.objects(
-        ent_id=ent_id
-    ).limit(1)
-
-    args, update = _update_tags(
-        query=q_ent,
-        args=args
-    )
-
+    ent_keys = {'ent_id': ent_id}
     try:
         # Write data to the backend
-        args = _put_item(
+        args, _ = _put_item(
+            model=models.Entities,
             args=args,
-            query=q_ent,
-            ent_id=ent_id,
-            update=update,
+            keys=ent_keys,
+            statements=_tag_index_statements(
+                model=models.Entities,
+                keys=ent_keys,
+                tags=args.get('tags')
+            )
         )
     except Exception as exp:
         LOG.critical(exps.log_exception(exp))
         return {'ERROR': str(exp)}, 400
     else:
-        return self._friendly_return(args), 200
+        return args, 200
@@ -0,0 +1,204 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+# Column types, collections are stored as JSON documents.
+TEXT = 'TEXT'
+INTEGER = 'INTEGER'
+DATETIME = 'DATETIME'
+SET = 'SET'
+MAP = 'MAP'
+
+
+class Column(object):
+    """Column of a table.
+
+    :param kind: Column type
+    :type kind: string
+    :param required: A value has to be provided on create
+    :type required: bool
+    :param index: Create an index on the column
+    :type index: bool
+    """
+
+    def __init__(self, kind, required=False, index=False):
+        self.kind = kind
+        self.required = required
+        self.index = index
+
+    @property
+    def sql_type(self):
+        if self.kind == INTEGER:
+            return 'INTEGER'
+        else:
+            return 'TEXT'
+
+
+class CrutonBaseModel(object):
+    __table_name__ = None
+
+    __model_map__ = {
+        'name': str,
+        'tags': set,
+        'links': dict
+    }
+
+    # Primary key columns, ordered from the outermost parent to the row.
+    _primary_keys = []
+
+    _columns = {
+        'id': Column(TEXT, index=True),
+        'name': Column(TEXT, required=True, index=True),
+        'created_at': Column(DATETIME),
+        'updated_at': Column(DATETIME),
+        'tags': Column(SET),
+        'links': Column(MAP),
+        'description': Column(TEXT),
+        # Lowercased values of the searchable columns, see
+        #  search.search_tokens.
+        'search_tokens': Column(SET)
+    }
+
+    @classmethod
+    def table_name(cls):
+        return cls.__table_name__
+
+    @classmethod
+    def tag_table_name(cls):
+        return '%s_by_tag' % cls.__table_name__
+
+
+class Entities(CrutonBaseModel):
+    CrutonBaseModel.__model_map__.update({
+        'ent_id': str,
+        'ent_contacts': dict
+    })
+
+    __table_name__ = 'entities'
+
+    _primary_keys = ['ent_id']
+
+    _columns = dict(
+        CrutonBaseModel._columns,
+        ent_id=Column(TEXT, required=True),
+        contacts=Column(MAP)
+    )
+
+
+class Environments(CrutonBaseModel):
+    CrutonBaseModel.__model_map__.update({
+        'ent_id': str,
+        'env_id': str,
+        'env_contacts': dict,
+        'vars': dict
+    })
+
+    __table_name__ = 'environments'
+
+    _primary_keys = ['ent_id', 'env_id']
+
+    _columns = dict(
+        CrutonBaseModel._columns,
+        env_id=Column(TEXT, required=True),
+        ent_id=Column(TEXT, required=True),
+        contacts=Column(MAP),
+        vars=Column(MAP)
+    )
+
+
+class Devices(CrutonBaseModel):
+    CrutonBaseModel.__model_map__.update({
+        'dev_id': str,
+        'env_id': str,
+        'ent_id': str,
+        'row_id': str,
+        'rack_id': str,
+        'units': str,
+        'asset_id': str,
+        'access_ip': dict,
+        'ports': dict,
+        'vars': dict
+    })
+
+    __table_name__ = 'devices'
+
+    _primary_keys = ['ent_id', 'env_id', 'dev_id']
+
+    _columns = dict(
+        CrutonBaseModel._columns,
+        dev_id=Column(TEXT, required=True),
+        env_id=Column(TEXT, required=True),
+        ent_id=Column(TEXT, required=True),
+        row_id=Column(TEXT),
+        rack_id=Column(TEXT),
+        units=Column(INTEGER),
+        asset_id=Column(TEXT),
+        access_ip=Column(MAP),
+        ports=Column(MAP),
+        vars=Column(MAP)
+    )
+
+
+MODELS = [Entities, Environments, Devices]
+
+
+def create_statements(model):
+    """Return the statements creating the tables and indexes of a model.
+
+    Rows are stored within a table keyed by their primary keys, a tag index
+    table is keyed by the tag and the primary keys of the tagged rows.
+
+    :param model: DB Model object
+    :type model: object
+    :return: list
+    """
+    table = model.table_name()
+    tag_table = model.tag_table_name()
+    columns = [
+        '%s %s' % (k, v.sql_type) for k, v in sorted(model._columns.items())
+    ]
+    statements = [
+        'CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (%s))' % (
+            table,
+            ', '.join(columns),
+            ', '.join(model._primary_keys)
+        ),
+        'CREATE TABLE IF NOT EXISTS %s (tag TEXT, %s, PRIMARY KEY (tag, %s))'
+        ' WITHOUT ROWID' % (
+            tag_table,
+            ', '.join(['%s TEXT' % k for k in model._primary_keys]),
+            ', '.join(model._primary_keys)
+        )
+    ]
+    for k, v in sorted(model._columns.items()):
+        if v.index:
+            statements.append(
+                'CREATE INDEX IF NOT EXISTS %s_%s_idx ON %s (%s)' % (
+                    table, k, table, k
+                )
+            )
+    return statements
+
+
+def sync_tables(keyspace=None):
+    """Create the tables and indexes of all models."""
+    import utils
+    utils.sync_tables()
+
+
+def rebuild_lookups(keyspace=None):
+    """Populate the tag index tables and search tokens from the rows stored."""
+    import utils
+    utils.rebuild_lookups()
@@ -0,0 +1,1105 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import atexit
+import base64
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import models
+
+from cruton import exceptions as exps
+from cruton import metrics
+from cruton.data_store import search
+from cruton.data_store import variables
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Access paths in order of preference.
+PRIMARY_KEY = 'primary_key'
+PARTITION = 'partition'
+TAG = 'tag'
+INDEX = 'index'
+SCAN = 'scan'
+
+
+class Exceptions(object):
+    """General exceptions class.
+
+    This class puulls in the execptions from the driver in a method allowing
+    it to be universally accessed.
+    """
+    InvalidRequest = sqlite3.OperationalError
+
+
+def _create_tables(conn):
+    """Create the tables and indexes of all models.
+
+    Columns added to a model after its table was created are added to the
+    table.
+
+    :param conn: Connection
+    :type conn: object
+    """
+    for model in models.MODELS:
+        for statement in models.create_statements(model=model):
+            conn.execute(statement)
+
+        table = model.table_name()
+        existing = [
+            i[1] for i in conn.execute('PRAGMA table_info(%s)' % table)
+        ]
+        for k, v in sorted(model._columns.items()):
+            if k not in existing:
+                conn.execute(
+                    'ALTER TABLE %s ADD COLUMN %s %s' % (table, k, v.sql_type)
+                )
+
+
+class ConnectionRegistry(object):
+    """Process wide connection to the embedded database.
+
+    The connection is opened once per process, a forked worker opens its
+    own. Statements are serialized with a lock so the connection can be
+    shared by every thread of the process.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+
+    @staticmethod
+    def _connect():
+        database = CONF['data_store']['database']
+        if database != ':memory:':
+            directory = os.path.dirname(database)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        conn = sqlite3.connect(
+            database,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        _create_tables(conn=conn)
+        LOG.info('Data store database [ %s ] opened', database)
+        return conn
+
+    def setup(self):
+        """Return the connection of the running process.
+
+        :return: object
+        """
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                self.conn = self._connect()
+                self.pid = os.getpid()
+            return self.conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the statements within the context as one transaction."""
+        with self.lock:
+            conn = self.setup()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+
+    def shutdown(self):
+        """Close the connection of the running process."""
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
+            self.pid = None
+
+
+CONNECTION_REGISTRY = ConnectionRegistry()
+atexit.register(CONNECTION_REGISTRY.shutdown)
+
+
+def close(conn=None):
+    """Close the open connection for the running process."""
+    CONNECTION_REGISTRY.shutdown()
+
+
+def setup():
+    """Return the process wide connection."""
+    return CONNECTION_REGISTRY.setup()
+
+
+def cache_stats():
+    """Return the size, hits and misses of the driver caches.
+
+    The embedded database is read directly, the driver keeps no caches.
+
+    :return: dict
+    """
+    return dict()
+
+
+def _where(keys):
+    """Return a bind marker WHERE clause for the given column names."""
+    return ' AND '.join(['%s = ?' % k for k in keys])
+
+
+def _query(conn, sql, params=None):
+    """Execute a statement and return the rows read as dicts."""
+    with metrics.timer(stage='data_store'):
+        return [
+            dict(i) for i in conn.execute(sql, params or list()).fetchall()
+        ]
+
+
+def _execute(sql, params=None):
+    """Execute a statement on the process wide connection.
+
+    :param sql: SQL query string
+    :type sql: string
+    :param params: Bind parameters
+    :type params: list
+    :return: list
+    """
+    with CONNECTION_REGISTRY.lock:
+        return _query(conn=setup(), sql=sql, params=params)
+
+
+def _to_database(model, k, v):
+    """Return a value converted to be stored within a column."""
+    if v is None:
+        return None
+
+    kind = model._columns[k].kind
+    if kind == models.SET:
+        return json.dumps(sorted(v))
+    elif kind == models.MAP:
+        return json.dumps(v, sort_keys=True)
+    elif kind == models.DATETIME:
+        return v.strftime(DATETIME_FORMAT)
+    elif kind == models.INTEGER:
+        return int(v)
+    else:
+        return str(v)
+
+
+def _from_database(model, row):
+    """Return a row dict with values converted using the model columns.
+
+    Empty collections are returned empty rather than None.
+    """
+    for k, v in row.items():
+        column = model._columns.get(k)
+        if column is None:
+            continue
+        elif column.kind == models.SET:
+            row[k] = set(json.loads(v)) if v else set()
+        elif column.kind == models.MAP:
+            row[k] = json.loads(v) if v else dict()
+        elif column.kind == models.DATETIME and v:
+            row[k] = datetime.datetime.strptime(v, DATETIME_FORMAT)
+    return row
+
+
+class QueryPlan(object):
+    """Access path chosen for a lookup.
+
+    :param model: DB Model object
+    :type model: object
+    :param path: Access path name
+    :type path: string
+    :param keys: Key column names and values known for the lookup
+    :type keys: dict
+    :param index: Indexed column name and value
+    :type index: tuple
+    """
+
+    def __init__(self, model, path, keys, index=None):
+        self.model = model
+        self.path = path
+        self.keys = keys
+        self.index = index
+
+    def __str__(self):
+        via = ''
+        if self.path == TAG:
+            via = ' via %s' % self.model.tag_table_name()
+        elif self.index:
+            via = ' via %s index' % self.index[0]
+        return '%s %s%s [%s]' % (
+            self.path,
+            self.model.table_name(),
+            via,
+            ', '.join(sorted(self.keys.keys()))
+        )
+
+
+def _plan(model, keys, query=None, fuzzy=False, tag=None):
+    """Return the cheapest access path for a lookup.
+
+    Rows are keyed by their primary keys ordered from the outermost parent,
+    so any leading primary keys can be read from the primary key index.
+
+    :param model: DB Model object
+    :type model: object
+    :param keys: Key column names and values known from the request path
+    :type keys: dict
+    :param query: Search parameters from the request
+    :type query: dict
+    :param fuzzy: Enables or disables a fuzzy search.
+    :type fuzzy: bool
+    :param tag: Tag searched for
+    :type tag: string
+    :return: QueryPlan
+    """
+    keys = dict([(k, v) for k, v in keys.items() if v])
+    if all([k in keys for k in model._primary_keys]):
+        return QueryPlan(model=model, path=PRIMARY_KEY, keys=keys)
+
+    # Fuzzy searches can not use an index, the criteria is a partial match.
+    if tag and not fuzzy:
+        return QueryPlan(model=model, path=TAG, keys=keys, index=('tag', tag))
+
+    if keys:
+        return QueryPlan(model=model, path=PARTITION, keys=keys)
+
+    if query and not fuzzy:
+        for name in sorted(model._columns.keys()):
+            if model._columns[name].index and query.get(name):
+                return QueryPlan(
+                    model=model,
+                    path=INDEX,
+                    keys=keys,
+                    index=(name, query[name])
+                )
+
+    return QueryPlan(model=model, path=SCAN, keys=keys)
+
+
+class Page(object):
+    """Page of rows requested with the limit and page_token parameters.
+
+    The page token is the offset of the next page encoded as url safe
+    base64.
+
+    :param size: Number of rows to fetch
+    :type size: int
+    :param token: Page token returned with the previous page
+    :type token: string
+    """
+
+    def __init__(self, size, token=None):
+        self.size = size
+        self.offset = 0
+        self.next_token = None
+        if token:
+            try:
+                self.offset = int(base64.urlsafe_b64decode(str(token)))
+            except (TypeError, ValueError):
+                raise exps.InvalidRequest('Invalid page_token [ %s ]', token)
+
+    def set_fetched(self, count):
+        """Store the number of rows of the page which was just fetched."""
+        if count < self.size:
+            self.next_token = None
+        else:
+            self.next_token = base64.urlsafe_b64encode(
+                str(self.offset + count).encode('ascii')
+            ).decode('ascii')
+
+
+def _page(query):
+    """Return a Page from the limit and page_token query parameters.
+
+    :param query: Search parameters from the request
+    :type query: dict
+    :return: Page || None
+    """
+    limit, token = search.page_params(query=query)
+    if limit:
+        return Page(size=limit, token=token)
+
+
+def _run_plan(query_plan, page=None, columns=None):
+    """Return the rows found by following a query plan.
+
+    :param query_plan: Access path chosen for the lookup
+    :type query_plan: QueryPlan
+    :param page: Page of rows to return
+    :type page: Page
+    :param columns: Column names to select, all columns when not set.
+    :type columns: list
+    :return: list
+    """
+    model = query_plan.model
+    key_items = sorted(query_plan.keys.items())
+    where = ['t.%s = ?' % k for k, _ in key_items]
+    params = [v for _, v in key_items]
+    sql = 'SELECT %s FROM %s t' % (
+        ', '.join(['t.%s' % k for k in columns]) if columns else 't.*',
+        model.table_name()
+    )
+    if query_plan.path == TAG:
+        sql += ' JOIN %s g ON %s' % (
+            model.tag_table_name(),
+            ' AND '.join(['g.%s = t.%s' % (k, k) for k in model._primary_keys])
+        )
+        where.append('g.tag = ?')
+        params.append(query_plan.index[1])
+    elif query_plan.index:
+        where.append('t.%s = ?' % query_plan.index[0])
+        params.append(query_plan.index[1])
+
+    if where:
+        sql += ' WHERE %s' % ' AND '.join(where)
+    sql += ' ORDER BY %s' % ', '.join(
+        ['t.%s' % k for k in model._primary_keys]
+    )
+
+    if query_plan.path == SCAN:
+        LOG.info('Full table scan of [ %s ]', model.table_name())
+    if page is not None:
+        sql += ' LIMIT ? OFFSET ?'
+        params.extend([page.size, page.offset])
+
+    rows = _execute(sql=sql, params=params)
+    if page is not None:
+        page.set_fetched(count=len(rows))
+    return [_from_database(model=model, row=row) for row in rows]
+
+
+def _get_search(self, model, ent_id=None, env_id=None, dev_id=None,
+                stream=False, scan_all=False):
+    """Retrieve a list of entities.
+
+    A scan which isn't paged by the request returns its first scan_limit
+    rows and sets the page token of the rest, so a listing is never cut
+    short without the client knowing.
+
+    :param self: Class object
+    :type self: object || query
+    :param model: DB Model object
+    :type model: object
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param dev_id: Device ID
+    :type dev_id: string
+    :param stream: Return a generator which filters rows as it is consumed.
+    :type stream: bool
+    :param scan_all: Read every row of a scan, such as to count them.
+    :type scan_all: bool
+    :return: list || generator
+    """
+
+    # This creates a single use search criteria hash which is used to look
+    #  inside a list or other hashable type.
+    search_dict = search.search_items(query=self.query)
+
+    lookup_params = dict()
+    if ent_id:
+        lookup_params['ent_id'] = ent_id
+    if env_id:
+        lookup_params['env_id'] = env_id
+    if dev_id:
+        lookup_params['dev_id'] = dev_id
+
+    fuzzy = self.query.pop('fuzzy', False)
+    page = _page(query=self.query)
+    fields = search.fields_param(query=self.query, columns=model._columns)
+    columns = search.select_columns(
+        fields=fields,
+        primary_keys=list(model._primary_keys),
+        criteria=[
+            k for k in list(search_dict) + list(self.query)
+            if k in model._columns
+        ]
+    )
+    query_plan = self.query_plan = _plan(
+        model=model,
+        keys=lookup_params,
+        query=self.query,
+        fuzzy=fuzzy,
+        tag=search_dict.get('tags')
+    )
+    LOG.debug('Query plan: %s', query_plan)
+    scan_limit = CONF['data_store']['scan_limit']
+    scanned = query_plan.path == SCAN
+    if page is None and scanned and scan_limit and not scan_all:
+        page = Page(size=scan_limit)
+    try:
+        results = search.search(
+            self=self,
+            q=_run_plan(query_plan=query_plan, page=page, columns=columns),
+            search_items=search_dict.items(),
+            lookup_params=self.query,
+            fuzzy=fuzzy,
+            fields=fields
+        )
+        if not stream:
+            results = list(results)
+    except Exception as exp:
+        LOG.warn(exps.log_exception(exp))
+        return list()
+    else:
+        if page is not None:
+            self.next_page_token = page.next_token
+        return results
+
+
+def get_device(self, ent_id, env_id, dev_id=None, stream=False):
+    """Retrieve a list of entities.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param dev_id: Device ID
+    :type dev_id: string
+    :param stream: Return a generator instead of a list
+    :type stream: bool
+    :return: list || generator
+    """
+    return _get_search(
+        self=self,
+        model=models.Devices,
+        ent_id=ent_id,
+        env_id=env_id,
+        dev_id=dev_id,
+        stream=stream
+    )
+
+
+def get_device_vars(self, ent_id, env_id, dev_id):
+    """Return the variables of a device, None if it does not exist.
+
+    Only the vars column is read, by primary key.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param dev_id: Device ID
+    :type dev_id: string
+    :return: Mapping || None
+    """
+    rows = _execute(
+        sql='SELECT vars FROM %s WHERE %s' % (
+            models.Devices.table_name(),
+            _where(keys=['ent_id', 'env_id', 'dev_id'])
+        ),
+        params=[ent_id, env_id, dev_id]
+    )
+    if rows:
+        row = _from_database(model=models.Devices, row=rows[0])
+        return search.convert_from_json(q_got=row)['vars']
+
+
+def get_environment(self, ent_id, env_id=None, stream=False):
+    """Retrieve a list of entities.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param stream: Return a generator instead of a list
+    :type stream: bool
+    :return: list || generator
+    """
+    return _get_search(
+        self=self,
+        model=models.Environments,
+        ent_id=ent_id,
+        env_id=env_id,
+        stream=stream
+    )
+
+
+def get_entity(self, ent_id, stream=False):
+    """Retrieve a list of entities.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param stream: Return a generator instead of a list
+    :type stream: bool
+    :return: list || generator
+    """
+    return _get_search(
+        self=self,
+        model=models.Entities,
+        ent_id=ent_id,
+        stream=stream
+    )
+
+
+def updated_at(model, **keys):
+    """Return when a row was last updated, None if it does not exist.
+
+    :param model: DB Model object
+    :type model: object
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :return: datetime || None
+    """
+    key_items = sorted(keys.items())
+    rows = _execute(
+        sql='SELECT updated_at FROM %s WHERE %s' % (
+            model.table_name(),
+            _where(keys=[k for k, _ in key_items])
+        ),
+        params=[v for _, v in key_items]
+    )
+    if rows:
+        return _from_database(model=model, row=rows[0])['updated_at']
+
+
+def _count(self, model, **keys):
+    """Return the number of rows of a model.
+
+    Rows are counted from the primary key index. When search criteria was
+    provided the rows found by the search are counted instead.
+
+    :param self: Class object
+    :type self: object || query
+    :param model: DB Model object
+    :type model: object
+    :param keys: Key column names and values
+    :type keys: dict
+    :return: int
+    """
+    if self.query:
+        return sum([
+            1 for _ in _get_search(
+                self,
+                model,
+                stream=True,
+                scan_all=True,
+                **keys
+            )
+        ])
+
+    key_items = sorted([(k, v) for k, v in keys.items() if v])
+    sql = 'SELECT COUNT(*) AS total FROM %s' % model.table_name()
+    if key_items:
+        sql += ' WHERE %s' % _where(keys=[k for k, _ in key_items])
+    rows = _execute(sql=sql, params=[v for _, v in key_items])
+    return rows[0]['total']
+
+
+def count_device(self, ent_id, env_id, exact=False):
+    """Return the number of devices within an environment.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param exact: Unused, counts are always exact
+    :type exact: bool
+    :return: int
+    """
+    return _count(
+        self=self,
+        model=models.Devices,
+        ent_id=ent_id,
+        env_id=env_id
+    )
+
+
+def count_environment(self, ent_id, exact=False):
+    """Return the number of environments within an entity.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param exact: Unused, counts are always exact
+    :type exact: bool
+    :return: int
+    """
+    return _count(
+        self=self,
+        model=models.Environments,
+        ent_id=ent_id
+    )
+
+
+def count_entity(self, exact=False):
+    """Return the number of entities.
+
+    :param self: Class object
+    :type self: object || query
+    :param exact: Unused, counts are always exact
+    :type exact: bool
+    :return: int
+    """
+    return _count(
+        self=self,
+        model=models.Entities
+    )
+
+
+def _exists(conn, model, **keys):
+    """Return True if a row exists.
+
+    :param conn: Connection with an open transaction
+    :type conn: object
+    :param model: DB Model object
+    :type model: object
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :return: bool
+    """
+    key_items = sorted(keys.items())
+    rows = _query(
+        conn=conn,
+        sql='SELECT 1 FROM %s WHERE %s' % (
+            model.table_name(),
+            _where(keys=[k for k, _ in key_items])
+        ),
+        params=[v for _, v in key_items]
+    )
+    return len(rows) > 0
+
+
+def _write_item(conn, model, keys, args):
+    """Write an item, creating or updating its row.
+
+    Map and set columns are merged with the stored values and the tags of
+    the row are added to the tag index.
+
+    :param conn: Connection with an open transaction
+    :type conn: object
+    :param model: DB Model object
+    :type model: object
+    :param keys: Primary key column names and values
+    :type keys: dict
+    :param args: Dictionary arguments
+    :type args: dict
+    :return: dict, bool (update)
+    """
+    if args.get('vars'):
+        args['vars'] = variables.encode_vars(variables=args['vars'])
+
+    key_items = sorted(keys.items())
+    table = model.table_name()
+    rows = _query(
+        conn=conn,
+        sql='SELECT * FROM %s WHERE %s' % (
+            table,
+            _where(keys=[k for k, _ in key_items])
+        ),
+        params=[v for _, v in key_items]
+    )
+
+    args['updated_at'] = datetime.datetime.utcnow()
+    columns = dict(args)
+    if rows:
+        row = _from_database(model=model, row=rows[0])
+        items = list()
+        for k, v in sorted(columns.items()):
+            column = model._columns.get(k)
+            if column is None or k in keys or k == search.TOKENS_COLUMN:
+                continue
+            elif column.kind == models.SET:
+                v = row[k] | set(v or list())
+            elif column.kind == models.MAP:
+                v = dict(row[k], **(v or dict()))
+            row[k] = v
+            items.append((k, _to_database(model=model, k=k, v=v)))
+        # The tokens are those of the merged row, rather than merged with
+        #  the stored ones, so they hold every value of the row.
+        items.append((
+            search.TOKENS_COLUMN,
+            _to_database(
+                model=model,
+                k=search.TOKENS_COLUMN,
+                v=search.search_tokens(args=row, complete=True)
+            )
+        ))
+        conn.execute(
+            'UPDATE %s SET %s WHERE %s' % (
+                table,
+                ', '.join(['%s = ?' % k for k, _ in items]),
+                _where(keys=[k for k, _ in key_items])
+            ),
+            [v for _, v in items] + [v for _, v in key_items]
+        )
+    else:
+        args['created_at'] = args['updated_at']
+        args.update(keys)
+        columns.update(args)
+        columns[search.TOKENS_COLUMN] = search.search_tokens(
+            args=args,
+            complete=True
+        )
+        values = dict(
+            [(k, v) for k, v in columns.items() if k in model._columns]
+        )
+        values.setdefault('id', uuid.uuid4())
+        missing = sorted([
+            k for k, v in model._columns.items()
+            if v.required and values.get(k) is None
+        ])
+        if missing:
+            raise exps.InvalidRequest(
+                'Required fields are missing: %s' % ', '.join(missing)
+            )
+        items = sorted(values.items())
+        conn.execute(
+            'INSERT INTO %s (%s) VALUES (%s)' % (
+                table,
+                ', '.join([k for k, _ in items]),
+                ', '.join(['?'] * len(items))
+            ),
+            [_to_database(model=model, k=k, v=v) for k, v in items]
+        )
+
+    tags = args.get('tags')
+    if tags:
+        key_names = [k for k, _ in key_items]
+        conn.executemany(
+            'INSERT OR IGNORE INTO %s (tag, %s) VALUES (?, %s)' % (
+                model.tag_table_name(),
+                ', '.join(key_names),
+                ', '.join(['?'] * len(key_names))
+            ),
+            [[tag] + [v for _, v in key_items] for tag in sorted(tags)]
+        )
+    return search.convert_from_json(q_got=args), bool(rows)
+
+
+def _link(endpoint, end_id):
+    """Return the link to a child from the endpoint it was written to."""
+    if endpoint.endswith(end_id):
+        return endpoint
+    else:
+        return '%s/%s' % (endpoint, end_id)
+
+
+def _write_links(conn, model, keys, links):
+    """Add links to a parent.
+
+    :param conn: Connection with an open transaction
+    :type conn: object
+    :param model: DB Model object of the parent
+    :type model: object
+    :param keys: Primary key column names and values of the parent
+    :type keys: dict
+    :param links: Child IDs and the links to them
+    :type links: dict
+    """
+    _write_item(conn=conn, model=model, keys=keys, args={'links': links})
+
+
+def _parents_missing(conn, ent_id, env_id=None):
+    """Return the error of a missing parent, None when the parents exist.
+
+    :param conn: Connection with an open transaction
+    :type conn: object
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :return: dict, int || None
+    """
+    if env_id and not _exists(
+            conn, models.Environments, ent_id=ent_id, env_id=env_id):
+        LOG.warn('Environment [ %s ] was not found', env_id)
+        return {'ERROR': 'Environment [%s] was not found' % env_id}, 412
+
+    if not _exists(conn, models.Entities, ent_id=ent_id):
+        LOG.critical('Entity [ %s ] was not found', ent_id)
+        return {'ERROR': 'Entity [%s] was not found' % ent_id}, 412
+
+
+def put_device(self, ent_id, env_id, dev_id, args):
+    """PUT an entity.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param dev_id: Device ID
+    :type dev_id: string
+    :param args: Dictionary arguments
+    :type args: dict
+    :return: string, int
+    """
+    returns, code = put_devices(
+        self=self,
+        ent_id=ent_id,
+        env_id=env_id,
+        items=[(dev_id, args)]
+    )
+    if code >= 300:
+        return returns, code
+    elif 'ERROR' in returns[0]:
+        returns[0].pop('dev_id', None)
+        return returns[0], 400
+    else:
+        return returns[0], 200
+
+
+def _write_devices(self, conn, ent_id, env_id, items):
+    """Write devices and the links to them.
+
+    A device which fails to write is rolled back on its own and returned
+    with an ERROR. The links are written at once, when they fail to write
+    every device is rolled back to the devices savepoint and returned with
+    the ERROR.
+
+    :param self: Class object
+    :type self: object || query
+    :param conn: Connection with an open transaction
+    :type conn: object
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param items: Device IDs and their dictionary arguments
+    :type items: list
+    :return: list
+    """
+    returns = list()
+    links = dict()
+    for dev_id, args in items:
+        conn.execute('SAVEPOINT device')
+        try:
+            args, _ = _write_item(
+                conn=conn,
+                model=models.Devices,
+                keys={
+                    'env_id': env_id,
+                    'ent_id': ent_id,
+                    'dev_id': dev_id
+                },
+                args=self.convert(args)
+            )
+        except Exception as exp:
+            conn.execute('ROLLBACK TO SAVEPOINT device')
+            LOG.critical(exps.log_exception(exp))
+            returns.append({'dev_id': dev_id, 'ERROR': str(exp)})
+        else:
+            returns.append(args)
+            links[dev_id] = _link(endpoint=self.endpoint, end_id=dev_id)
+        finally:
+            conn.execute('RELEASE SAVEPOINT device')
+
+    if links:
+        try:
+            _write_links(
+                conn=conn,
+                model=models.Environments,
+                keys={'env_id': env_id, 'ent_id': ent_id},
+                links=links
+            )
+        except Exception as exp:
+            conn.execute('ROLLBACK TO SAVEPOINT devices')
+            LOG.critical(exps.log_exception(exp))
+            returns = [
+                {'dev_id': dev_id, 'ERROR': str(exp)}
+                if dev_id in links else item
+                for (dev_id, _), item in zip(items, returns)
+            ]
+    return returns
+
+
+def put_devices(self, ent_id, env_id, items):
+    """PUT many devices at once.
+
+    All devices are written within one transaction, see _write_devices.
+    An error beginning or committing the transaction, such as a locked
+    database, is returned with a 400.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param items: Device IDs and their dictionary arguments
+    :type items: list
+    :return: list, int
+    """
+    try:
+        with CONNECTION_REGISTRY.transaction() as conn:
+            missing = _parents_missing(
+                conn=conn,
+                ent_id=ent_id,
+                env_id=env_id
+            )
+            if missing:
+                return missing
+
+            conn.execute('SAVEPOINT devices')
+            returns = _write_devices(
+                self=self,
+                conn=conn,
+                ent_id=ent_id,
+                env_id=env_id,
+                items=items
+            )
+            conn.execute('RELEASE SAVEPOINT devices')
+    except Exception as exp:
+        LOG.critical(exps.log_exception(exp))
+        return {'ERROR': str(exp)}, 400
+
+    if any(['ERROR' in i for i in returns]):
+        return returns, 207
+    else:
+        return returns, 200
+
+
+def put_environment(self, ent_id, env_id, args):
+    """PUT an entity.
+
+    :param self: Class object
+    :type self: object || query
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param env_id: Environment ID
+    :type env_id: string
+    :param args: Dictionary arguments
+    :type args: dict
+    :return: string, int
+    """
+    try:
+        with CONNECTION_REGISTRY.transaction() as conn:
+            missing = _parents_missing(conn=conn, ent_id=ent_id)
+            if missing:
+                return missing
+
+            args, _ = _write_item(
+                conn=conn,
+                model=models.Environments,
+                keys={'env_id': env_id, 'ent_id': ent_id},
+                args=args
+            )
+            _write_links(
+                conn=conn,
+                model=models.Entities,
+                keys={'ent_id': ent_id},
+                links={env_id: _link(endpoint=self.endpoint, end_id=env_id)}
+            )
+    except Exception as exp:
+        LOG.critical(exps.log_exception(exp))
+        return {'ERROR': str(exp)}, 400
+    else:
+        return args, 200
+
+
+def put_entity(self, ent_id, args):
+    """PUT an entity.
+
+    :param self: object
+    :param ent_id: Entity ID
+    :type ent_id: string
+    :param args: Dictionary arguments
+    :type ent_id: dict
+    :return: string, int
+    """
+    try:
+        with CONNECTION_REGISTRY.transaction() as conn:
+            args, _ = _write_item(
+                conn=conn,
+                model=models.Entities,
+                keys={'ent_id': ent_id},
+                args=args
+            )
+    except Exception as exp:
+        LOG.critical(exps.log_exception(exp))
+        return {'ERROR': str(exp)}, 400
+    else:
+        return args, 200
+
+
+def sync_tables():
+    """Create the tables and indexes of all models."""
+    with CONNECTION_REGISTRY.transaction() as conn:
+        _create_tables(conn=conn)
+
+
+def rebuild_lookups():
+    """Populate the tag index tables and search tokens from the rows stored."""
+    with CONNECTION_REGISTRY.transaction() as conn:
+        for model in models.MODELS:
+            key_names = model._primary_keys
+            conn.execute('DELETE FROM %s' % model.tag_table_name())
+            insert = 'INSERT OR IGNORE INTO %s (tag, %s) VALUES (?, %s)' % (
+                model.tag_table_name(),
+                ', '.join(key_names),
+                ', '.join(['?'] * len(key_names))
+            )
+            update = 'UPDATE %s SET %s = ? WHERE %s' % (
+                model.table_name(),
+                search.TOKENS_COLUMN,
+                _where(keys=key_names)
+            )
+            rows = _query(
+                conn=conn,
+                sql='SELECT * FROM %s' % model.table_name()
+            )
+            for row in rows:
+                row = _from_database(model=model, row=row)
+                key_values = [row[k] for k in key_names]
+                conn.executemany(
+                    insert,
+                    [[tag] + key_values for tag in row['tags']]
+                )
+                tokens = search.search_tokens(args=row, complete=True)
+                conn.execute(
+                    update,
+                    [
+                        _to_database(
+                            model=model,
+                            k=search.TOKENS_COLUMN,
+                            v=tokens
+                        )
+                    ] + key_values
+                )
@@ -20,6 +20,7 @@ import pkgutil
 from oslo_config import cfg
 
 import cruton
+from cruton import data_store as cruton_data_store
 import cruton.data_store.drivers as drivers
 
 
@@ -38,6 +39,11 @@ def add_command_parsers(subparsers):
         help="Sync the DB Tables."
     )
 
+    subparsers.add_parser(
+        'rebuild_lookups',
+        help="Populate the lookup tables from the data already stored."
+    )
+
 
 def main():
     """Main data store management entry point."""
@@ -60,15 +66,8 @@ def main():
     CONF(project='cruton')
 
     data_store = CONF['data_store']
-    data_connection_setup = cruton.dynamic_import(
-        path='cruton.data_store.drivers.%s.utils' % data_store['driver'],
-        module='setup'
-    )
-    if data_connection_setup:
-        data_connection_setup()
+    driver = cruton_data_store.DriverBase(name=data_store['driver'])
+    driver.setup()
 
-    sync_data_store_cmd = cruton.dynamic_import(
-        path='cruton.data_store.drivers.%s.models' % data_store['driver'],
-        module='sync_tables'
-    )
-    sync_data_store_cmd(keyspace=[data_store['keyspace']])
+    data_store_cmd = driver.command(name=CONF.command.name)
+    data_store_cmd(keyspace=[data_store['keyspace']])
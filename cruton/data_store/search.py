@@ -0,0 +1,375 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import re
+
+from oslo_config import cfg
+
+from cruton import exceptions as exps
+from cruton import metrics
+from cruton.data_store import variables
+
+
+CONF = cfg.CONF
+
+# Separators of the values stored within one string.
+SPLIT = re.compile(',|\n')
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+# Query parameters searched for within the collection columns of a row.
+SEARCH_PARAMS = [
+    ('tag', 'tags'),
+    ('port', 'ports'),
+    ('var', 'vars'),
+    ('link', 'links'),
+    ('contact', 'contacts')
+]
+
+# Mappings found within a row, variables are decoded as they are searched.
+MAPPING_TYPES = (dict, variables.Variables)
+
+# Column holding the search tokens of a row, see search_tokens. Links can be
+#  read from the children of a row rather than written with it, so they have
+#  no tokens.
+TOKENS_COLUMN = 'search_tokens'
+TOKENS_PARENTS = frozenset(
+    [parent for _, parent in SEARCH_PARAMS if parent != 'links']
+)
+# Token marking the tokens of a row as holding every searchable value of the
+#  row. Rows written before the tokens existed and then partially updated
+#  only hold the tokens of that update, their values are matched in full.
+TOKENS_COMPLETE = 'complete'
+
+
+def page_params(query):
+    """Pop and validate the limit and page_token query parameters.
+
+    :param query: Search parameters from the request
+    :type query: dict
+    :return: int || None, string || None
+    """
+    limit = query.pop('limit', None)
+    token = query.pop('page_token', None)
+    if not limit:
+        if token:
+            raise exps.InvalidRequest('<limit> is required with a page_token')
+        return None, None
+
+    max_limit = CONF['data_store']['page_limit']
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= max_limit:
+        raise exps.InvalidRequest(
+            '<limit> must be a number between 1 and %s', max_limit
+        )
+    return limit, token
+
+
+def fields_param(query, columns):
+    """Pop and validate the fields query parameter.
+
+    Fields are column names separated by commas, only these are returned.
+
+    :param query: Search parameters from the request
+    :type query: dict
+    :param columns: Column names of the model
+    :type columns: list
+    :return: list || None
+    """
+    fields = query.pop('fields', None)
+    if not fields:
+        return None
+
+    fields = sorted(set([i.strip() for i in SPLIT.split(fields) if i.strip()]))
+    unknown = [i for i in fields if i not in columns or i == TOKENS_COLUMN]
+    if unknown:
+        raise exps.InvalidRequest('Unknown fields [ %s ]', ', '.join(unknown))
+    return fields
+
+
+def select_columns(fields, primary_keys, criteria):
+    """Return the columns read to answer a request, None to read them all.
+
+    The primary keys and the columns searched are read along with the
+    fields requested, search removes them before returning a row.
+
+    :param fields: Fields requested, see fields_param
+    :type fields: list
+    :param primary_keys: Primary key column names
+    :type primary_keys: list
+    :param criteria: Column names searched
+    :type criteria: list
+    :return: list || None
+    """
+    if fields is None:
+        return None
+
+    columns = set(fields) | set(primary_keys) | set(criteria)
+    if set(criteria) & TOKENS_PARENTS:
+        columns.add(TOKENS_COLUMN)
+    return sorted(columns)
+
+
+def search_items(query):
+    """Pop the collection search parameters from the query parameters.
+
+    :param query: Search parameters from the request
+    :type query: dict
+    :return: dict of column names and the criteria searched for
+    """
+    items = dict()
+    for param, parent in SEARCH_PARAMS:
+        opt = query.pop(param, None)
+        if opt:
+            items[parent] = opt
+    return items
+
+
+def convert_from_json(q_got):
+    """Return a row with its variables decoded as they are read.
+
+    :param q_got: retrieved query
+    :type q_got: ``dict``
+    :return: dict
+    """
+    stored = q_got.get('vars')
+    if stored is not None and not isinstance(stored, variables.Variables):
+        q_got['vars'] = variables.Variables(stored=stored)
+    return q_got
+
+
+def _text(value):
+    """Return the text a scalar value is searched by."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (int, float)):
+        return str(value)
+    elif isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    else:
+        return value
+
+
+def search_tokens(args, complete=False):
+    """Return the search tokens of the searchable columns of a row.
+
+    Every scalar value within the collection columns searched becomes a
+    lowercased token prefixed with its column name. Strings containing
+    commas or newlines also add a token for each of their parts. The
+    tokens are written with the row so a search can skip the rows which
+    can't match without decoding their values.
+
+    :param args: Dictionary arguments written
+    :type args: dict
+    :param complete: The arguments hold every value of the row, such as when
+                     a row is created, mark the tokens as complete.
+    :type complete: bool
+    :return: set
+    """
+    # Variables are searched decoded, see convert_from_json.
+    decoded = dict(variables.Variables(stored=args.get('vars')))
+    tokens = set()
+    for parent in TOKENS_PARENTS:
+        stack = [decoded if parent == 'vars' else args.get(parent)]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, MAPPING_TYPES):
+                stack.extend(value.values())
+            elif isinstance(value, (list, set, tuple, frozenset)):
+                stack.extend(value)
+            elif value is not None:
+                value = _text(value)
+                if not isinstance(value, STRING_TYPES):
+                    continue
+                value = value.lower()
+                tokens.add('%s:%s' % (parent, value))
+                if ',' in value or '\n' in value:
+                    tokens.update([
+                        '%s:%s' % (parent, i.strip())
+                        for i in SPLIT.split(value) if i.strip()
+                    ])
+    if complete:
+        tokens.add(TOKENS_COMPLETE)
+    return tokens
+
+
+class Matcher(object):
+    """Search criteria compiled to match values of a row.
+
+    The criteria is normalized once, rows are then walked iteratively and
+    the walk stops at the first value matching. Strings containing commas
+    or newlines also match on their parts, the parts are cached as the
+    same values repeat across the rows of a search.
+
+    :param criteria: Item to search for.
+    :param fuzzy: Enables or disables a fuzzy search.
+    """
+
+    cache_size = 65536
+
+    def __init__(self, criteria, fuzzy=False):
+        self.fuzzy = fuzzy
+        self.criteria = _text(criteria)
+        if fuzzy:
+            self.criteria = self.criteria.lower()
+        self._parts = dict()
+
+    def candidate(self, column, tokens):
+        """Return False if the search tokens of a row rule out a match.
+
+        Tokens are lowercased so a candidate is confirmed by matching the
+        values of the row.
+
+        :param column: Column name the criteria is searched within
+        :type column: string
+        :param tokens: Search tokens of the row
+        :type tokens: set
+        :return: bool
+        """
+        prefix = '%s:' % column
+        if not self.fuzzy:
+            return prefix + self.criteria.lower() in tokens
+
+        criteria = self.criteria
+        for token in tokens:
+            if token.startswith(prefix) and criteria in token[len(prefix):]:
+                return True
+        return False
+
+    def _split(self, value):
+        try:
+            return self._parts[value]
+        except KeyError:
+            if len(self._parts) >= self.cache_size:
+                self._parts.clear()
+            parts = self._parts[value] = frozenset(
+                [i.strip() for i in SPLIT.split(value)]
+            )
+            return parts
+
+    def _match(self, value):
+        if self.fuzzy:
+            return self.criteria in value.lower()
+        elif value == self.criteria:
+            return True
+        elif ',' in value or '\n' in value:
+            return self.criteria in self._split(value)
+        else:
+            return False
+
+    def __call__(self, data_structure):
+        """Return True if the criteria is found within a data structure.
+
+        :param data_structure: Data structure to search through.
+        :returns: ``bool``
+        """
+        match = self._match
+        stack = [data_structure]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, STRING_TYPES):
+                if match(value):
+                    return True
+            elif isinstance(value, MAPPING_TYPES):
+                stack.extend(value.values())
+            elif isinstance(value, (list, set, tuple, frozenset)):
+                stack.extend(value)
+            elif value is not None:
+                value = _text(value)
+                if isinstance(value, STRING_TYPES) and match(value):
+                    return True
+        return False
+
+
+def deep_search(data_structure, criteria, fuzzy=False):
+    """Return True if the criteria is found within a data structure.
+
+    :param data_structure: Data structure to search through.
+    :param criteria: Item to search for.
+    :param fuzzy: Enables or disables a fuzzy search.
+    :returns: ``bool``
+    """
+    return Matcher(criteria=criteria, fuzzy=fuzzy)(data_structure)
+
+
+def _project(item, fields):
+    """Return the fields of an item, all of them when fields is None."""
+    if fields is None:
+        return item
+    return dict([(k, item[k]) for k in fields if k in item])
+
+
+def search(self, q, search_items, lookup_params, fuzzy, fields=None):
+    """Search query results.
+
+    Items are matched when any of the search criteria is found within them,
+    items are returned unfiltered when there is no criteria. Only the
+    fields requested are returned.
+
+    :return: generator
+    """
+    for k, v in search_items:
+        if v:
+            lookup_params[k] = v
+
+    # The criteria is compiled once for all of the rows searched.
+    matchers = [
+        (k, Matcher(criteria=v, fuzzy=fuzzy))
+        for k, v in lookup_params.items()
+    ]
+    request_metrics = metrics.current()
+    decode_timer = request_metrics.timer(stage='decode')
+    search_timer = request_metrics.timer(stage='search')
+    for i in q:
+        request_metrics.rows_scanned += 1
+        item = dict(i)
+        tokens = item.pop(TOKENS_COLUMN, None)
+        # Rows written before the search tokens existed have none, or only
+        #  those of their later updates.
+        if tokens and TOKENS_COMPLETE not in tokens:
+            tokens = None
+        if not matchers:
+            with decode_timer:
+                item = convert_from_json(q_got=item)
+            request_metrics.rows_returned += 1
+            yield _project(item=item, fields=fields)
+            continue
+
+        decoded = False
+        for k, matcher in matchers:
+            q_item = item.get(k)
+            if not q_item:
+                continue
+            if tokens and k in TOKENS_PARENTS:
+                with search_timer:
+                    if not matcher.candidate(column=k, tokens=tokens):
+                        continue
+            if not decoded:
+                with decode_timer:
+                    item = convert_from_json(q_got=item)
+                decoded = True
+            with search_timer:
+                matched = matcher(item[k])
+            if matched:
+                request_metrics.rows_returned += 1
+                yield _project(item=item, fields=fields)
+                break
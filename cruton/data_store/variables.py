@@ -0,0 +1,121 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import json
+import zlib
+
+try:
+    from collections import abc
+except ImportError:
+    import collections as abc
+
+
+# Every variable is stored as compact JSON behind a marker so it is decoded
+#  without guessing its type. Large values stored as bytes are compressed.
+JSON_MARKER = '\x01'
+ZLIB_MARKER = b'\x02'
+COMPRESS_SIZE = 512
+
+
+def encode(value, binary=False):
+    """Return a variable encoded for storage.
+
+    :param value: Variable value
+    :type value: object
+    :param binary: Return bytes, compressing large values
+    :type binary: bool
+    :return: string || bytes
+    """
+    data = JSON_MARKER + json.dumps(value, separators=(',', ':'))
+    if not binary:
+        return data
+
+    data = data.encode('utf-8')
+    if len(data) >= COMPRESS_SIZE:
+        return ZLIB_MARKER + zlib.compress(data[1:])
+    return data
+
+
+def encode_vars(variables, binary=False):
+    """Return the variables of a row encoded for storage.
+
+    :param variables: Variable names and values
+    :type variables: dict
+    :param binary: Return bytes, compressing large values
+    :type binary: bool
+    :return: dict
+    """
+    return dict(
+        [(k, encode(value=v, binary=binary)) for k, v in variables.items()]
+    )
+
+
+def decode(value):
+    """Return a stored variable decoded.
+
+    Variables stored before they were encoded are plain strings, or JSON
+    for lists and dicts, and are decoded as JSON when they are valid JSON.
+
+    :param value: Stored variable
+    :type value: string || bytes
+    :return: object
+    """
+    if isinstance(value, (bytes, bytearray)):
+        if value[:1] == ZLIB_MARKER:
+            value = zlib.decompress(bytes(value[1:]))
+            return json.loads(value.decode('utf-8'))
+        value = bytes(value).decode('utf-8', 'replace')
+
+    if value[:1] == JSON_MARKER:
+        return json.loads(value[1:])
+
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class Variables(abc.Mapping):
+    """Variables of a row which are decoded when they are read.
+
+    A row can be read, searched by its other columns and counted without
+    decoding its variables. A variable is decoded once.
+
+    :param stored: Stored variable names and values
+    :type stored: dict
+    """
+
+    __slots__ = ('_stored', '_decoded')
+
+    def __init__(self, stored=None):
+        self._stored = stored or dict()
+        self._decoded = dict()
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            value = self._decoded[key] = decode(self._stored[key])
+            return value
+
+    def __iter__(self):
+        return iter(self._stored)
+
+    def __len__(self):
+        return len(self._stored)
+
+    def __repr__(self):
+        return 'Variables(%r)' % (sorted(self._stored),)
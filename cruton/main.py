@@ -24,6 +24,7 @@ from oslo_config import cfg
 
 import cruton
 import cruton.api as api
+from cruton import serialize
 
 CONF = cfg.CONF
 
@@ -31,6 +32,7 @@ CONF = cfg.CONF
 APP = Flask(__name__)
 APP.config.update(PROPAGATE_EXCEPTIONS=True)
 API = Api(APP)
+API.representations['application/json'] = serialize.output_json
 LOG = logging.getLogger(__name__)
 
 DEFAULT_CONFIG_FILE = []
@@ -39,6 +41,15 @@ if os.path.exists('/etc/cruton/cruton.ini'):
 
 
 def init_application():
+    # The configuration is loaded before the resources are imported so the
+    #  data store driver they load is the one configured.
+    logging.register_options(CONF)
+    CONF(
+        project='cruton',
+        version=cruton.__version__,
+        default_config_files=DEFAULT_CONFIG_FILE
+    )
+    logging.setup(CONF, 'cruton-api')
     for k, v, in api.API_MAP.items():
         API.add_resource(
             cruton.dynamic_import(
@@ -49,19 +60,23 @@ def init_application():
         )
     else:
         API.add_resource(api.DocRoot, '/')
-        logging.register_options(CONF)
-        logging.setup(CONF, 'cruton-api')
-        CONF(
-            project='cruton',
-            version=cruton.__version__,
-            default_config_files=DEFAULT_CONFIG_FILE
-        )
         APP.config.update(CONF['api'])
+        # Every route is registered, serialize the discovery document once.
+        cruton.dynamic_import(
+            path=api.API_MAP['discovery']['path'],
+            module='build_document'
+        )(app=APP)
         return APP
 
 
 def debug():
-    return init_application().run(debug=True, **CONF['api'])
+    # The [api] group also holds tuning options, only the address is passed
+    #  to the development server.
+    return init_application().run(
+        debug=True,
+        host=CONF['api']['host'],
+        port=CONF['api']['port']
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,519 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import collections
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import timeit
+
+from flask import g, has_request_context
+
+from oslo_config import cfg
+
+
+CONF = cfg.CONF
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0
+)
+
+# Metric names, their type and help text.
+METRICS = {
+    'cruton_requests_total': (
+        'counter', 'Requests answered.'
+    ),
+    'cruton_request_duration_seconds': (
+        'histogram', 'Time taken to answer a request.'
+    ),
+    'cruton_request_stage_seconds': (
+        'histogram', 'Time a request spent within a stage.'
+    ),
+    'cruton_rows_scanned_total': (
+        'counter', 'Rows read from the data store to answer a search.'
+    ),
+    'cruton_rows_returned_total': (
+        'counter', 'Rows returned by a search.'
+    ),
+    'cruton_cache_hits_total': (
+        'counter', 'Cache lookups which found an entry.'
+    ),
+    'cruton_cache_misses_total': (
+        'counter', 'Cache lookups which found no valid entry.'
+    ),
+    'cruton_cache_entries': (
+        'gauge', 'Entries held within a cache.'
+    )
+}
+
+# Functions returning the gauges and counters kept by other modules, such as
+#  the hits of a cache, as a list of names, label dicts and values. They are
+#  collected when the metrics of a process are read.
+COLLECTORS = list()
+
+clock = timeit.default_timer
+
+
+class _Timer(object):
+    """Add the time spent within a block to a stage of a request.
+
+    A timer can be entered again while it is running, the outermost block is
+    timed. Stages timed within each other are both counted.
+    """
+
+    __slots__ = ('_stages', '_stage', '_depth', '_started')
+
+    def __init__(self, stages, stage):
+        self._stages = stages
+        self._stage = stage
+        self._depth = 0
+        self._started = 0
+
+    def __enter__(self):
+        if not self._depth:
+            self._started = clock()
+        self._depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self._depth -= 1
+        if not self._depth:
+            self._stages[self._stage] += clock() - self._started
+
+
+class RequestMetrics(object):
+    """Stage times and row counts of a request.
+
+    They are added up while the request is answered, without locking, and
+    recorded once the response has been sent, see record.
+    """
+
+    def __init__(self):
+        self.started = clock()
+        self.stages = collections.defaultdict(float)
+        self.rows_scanned = 0
+        self.rows_returned = 0
+        self._timers = dict()
+
+    def timer(self, stage):
+        """Return the timer of a stage.
+
+        :param stage: Stage name
+        :type stage: string
+        :return: object
+        """
+        try:
+            return self._timers[stage]
+        except KeyError:
+            timer = self._timers[stage] = _Timer(
+                stages=self.stages,
+                stage=stage
+            )
+            return timer
+
+
+class Registry(object):
+    """Counters, gauges and histograms of the running process.
+
+    Samples are keyed by metric name and a sorted tuple of label pairs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._histograms = dict()
+
+    def inc(self, name, labels, value=1):
+        """Increment a counter.
+
+        :param name: Metric name
+        :type name: string
+        :param labels: Label names and values
+        :type labels: dict
+        :param value: Amount to increment by
+        :type value: int
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, labels, value):
+        """Add a value to a histogram.
+
+        :param name: Metric name
+        :type name: string
+        :param labels: Label names and values
+        :type labels: dict
+        :param value: Observed value, in seconds
+        :type value: float
+        """
+        key = (name, tuple(sorted(labels.items())))
+        index = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        """Return the samples of the process, collectors included.
+
+        A histogram holds the number of values within each bucket, values
+        above the last bucket, followed by the sum of the values.
+
+        :return: dict
+        """
+        with self._lock:
+            counters = [
+                [name, list(labels), value]
+                for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                [name, list(labels), list(histogram)]
+                for (name, labels), histogram in self._histograms.items()
+            ]
+
+        gauges = list()
+        for collector in COLLECTORS:
+            for name, labels, value in collector():
+                sample = [name, sorted(labels.items()), value]
+                if METRICS[name][0] == 'gauge':
+                    gauges.append(sample)
+                else:
+                    counters.append(sample)
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms
+        }
+
+
+REGISTRY = Registry()
+_FLUSHED = {'at': None}
+
+
+def current():
+    """Return the metrics of the current request.
+
+    Outside of a request a throwaway object is returned, so code shared with
+    the management commands doesn't need to check.
+
+    :return: RequestMetrics
+    """
+    if not has_request_context():
+        return RequestMetrics()
+
+    request_metrics = getattr(g, 'request_metrics', None)
+    if request_metrics is None:
+        request_metrics = g.request_metrics = RequestMetrics()
+    return request_metrics
+
+
+def timer(stage):
+    """Return the timer of a stage of the current request.
+
+    :param stage: Stage name
+    :type stage: string
+    :return: object
+    """
+    return current().timer(stage=stage)
+
+
+def timed(stage, items):
+    """Return a generator adding the time taken to read each item to a stage.
+
+    :param stage: Stage name
+    :type stage: string
+    :param items: Items read lazily, such as rows
+    :type items: iterable
+    :return: generator
+    """
+    stage_timer = timer(stage=stage)
+    items = iter(items)
+    while True:
+        with stage_timer:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+        yield item
+
+
+def record(request_metrics, endpoint, method, code, path=None):
+    """Record the metrics of an answered request.
+
+    :param request_metrics: Metrics of the request
+    :type request_metrics: RequestMetrics
+    :param endpoint: URL rule of the request
+    :type endpoint: string
+    :param method: HTTP method
+    :type method: string
+    :param code: HTTP status code
+    :type code: int
+    :param path: Data store access path used
+    :type path: string
+    """
+    labels = {'endpoint': endpoint, 'method': method}
+    REGISTRY.inc(
+        'cruton_requests_total',
+        dict(labels, code=str(code))
+    )
+    REGISTRY.observe(
+        'cruton_request_duration_seconds',
+        labels,
+        clock() - request_metrics.started
+    )
+    for stage, seconds in request_metrics.stages.items():
+        REGISTRY.observe(
+            'cruton_request_stage_seconds',
+            dict(labels, stage=stage),
+            seconds
+        )
+    if request_metrics.rows_scanned or request_metrics.rows_returned:
+        labels = {'endpoint': endpoint, 'path': path or 'none'}
+        REGISTRY.inc(
+            'cruton_rows_scanned_total',
+            labels,
+            request_metrics.rows_scanned
+        )
+        REGISTRY.inc(
+            'cruton_rows_returned_total',
+            labels,
+            request_metrics.rows_returned
+        )
+
+    flushed = _FLUSHED['at']
+    interval = CONF['api']['metrics_flush_interval']
+    if flushed is None or clock() - flushed >= interval:
+        flush()
+
+
+def _worker_file(metrics_dir):
+    return os.path.join(metrics_dir, 'worker-%d.json' % os.getpid())
+
+
+def _write(path, data):
+    """Write a JSON file at once so a reader never sees part of it."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_path, path)
+
+
+def _read(path):
+    """Return the samples written to a file, None when it doesn't exist."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        # The file doesn't exist or was removed while it was read.
+        return None
+
+
+def _running(pid):
+    """Return True if a process is running."""
+    try:
+        os.kill(pid, 0)
+    except OSError as exp:
+        # The process exists but belongs to another user.
+        return exp.errno == errno.EPERM
+    return True
+
+
+def flush():
+    """Write the samples of the process for the other workers to read.
+
+    Nothing is written unless the metrics_dir option is set.
+    """
+    metrics_dir = CONF['api']['metrics_dir']
+    _FLUSHED['at'] = clock()
+    if not metrics_dir:
+        return
+
+    _write(
+        path=_worker_file(metrics_dir=metrics_dir),
+        data=REGISTRY.snapshot()
+    )
+
+
+def _key(labels):
+    return tuple([tuple(i) for i in labels])
+
+
+def _archive(archive, snapshot):
+    """Add the counters and histograms of a snapshot to the archive.
+
+    :param archive: Samples of the workers which are no longer running
+    :type archive: dict
+    :param snapshot: Samples of a worker which is no longer running
+    :type snapshot: dict
+    :return: dict
+    """
+    archived = dict()
+    for kind in ('counters', 'histograms'):
+        for name, labels, value in archive.get(kind, list()):
+            archived[(kind, name, _key(labels))] = [name, labels, value]
+        for name, labels, value in snapshot.get(kind, list()):
+            sample = archived.get((kind, name, _key(labels)))
+            if sample is None:
+                archived[(kind, name, _key(labels))] = [name, labels, value]
+            elif kind == 'counters':
+                sample[2] += value
+            else:
+                sample[2] = [a + b for a, b in zip(sample[2], value)]
+
+    archive = {'counters': list(), 'gauges': list(), 'histograms': list()}
+    for (kind, _, _), sample in archived.items():
+        archive[kind].append(sample)
+    return archive
+
+
+def _collect(metrics_dir):
+    """Return the samples of every worker, moving those no longer running.
+
+    Must be called holding the lock of the metrics_dir.
+    """
+    archive_path = os.path.join(metrics_dir, 'archive.json')
+    archive = _read(path=archive_path)
+    snapshots = list()
+    for name in os.listdir(metrics_dir):
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        try:
+            pid = int(name[len('worker-'):-len('.json')])
+        except ValueError:
+            continue
+
+        path = os.path.join(metrics_dir, name)
+        snapshot = _read(path=path)
+        if snapshot is None:
+            continue
+        elif _running(pid=pid):
+            snapshots.append(snapshot)
+            continue
+
+        archive = _archive(archive=archive or dict(), snapshot=snapshot)
+        _write(path=archive_path, data=archive)
+        os.remove(path)
+
+    if archive is not None:
+        snapshots.append(archive)
+    return snapshots
+
+
+def _snapshots():
+    """Return the samples of every worker sharing the metrics_dir.
+
+    The counters and histograms of workers which are no longer running,
+    such as respawned workers or the workers of a previous run of the
+    service, are moved to an archive file which is summed with the running
+    workers, so the sums never drop. Their gauges are dropped. The files
+    are read and moved under a lock, a worker file is never summed both on
+    its own and within the archive.
+    """
+    metrics_dir = CONF['api']['metrics_dir']
+    if not metrics_dir:
+        return [REGISTRY.snapshot()]
+
+    flush()
+    with open(os.path.join(metrics_dir, 'archive.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return _collect(metrics_dir=metrics_dir)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + list(extra or list())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join([
+        '%s="%s"' % (
+            k,
+            str(v).replace('\\', '\\\\').replace('"', '\\"').replace(
+                '\n', '\\n'
+            )
+        )
+        for k, v in pairs
+    ])
+
+
+def _value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render():
+    """Return the samples of every worker in the Prometheus text format.
+
+    Counters, gauges and histograms are summed across the workers which
+    share the metrics_dir, each worker only counting its own requests.
+
+    :return: string
+    """
+    samples = collections.defaultdict(dict)
+    for snapshot in _snapshots():
+        for kind in ('counters', 'gauges'):
+            for name, labels, value in snapshot[kind]:
+                key = _key(labels)
+                merged = samples[name]
+                merged[key] = merged.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = _key(labels)
+            merged = samples[name]
+            if key in merged:
+                merged[key] = [a + b for a, b in zip(merged[key], histogram)]
+            else:
+                merged[key] = list(histogram)
+
+    lines = list()
+    for name in sorted(samples):
+        kind, help_text = METRICS[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in sorted(samples[name].items()):
+            if kind != 'histogram':
+                lines.append(
+                    '%s%s %s' % (name, _labels(labels), _value(value))
+                )
+                continue
+
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name,
+                    _labels(labels, [('le', bound)]),
+                    cumulative
+                ))
+            lines.append(
+                '%s_sum%s %s' % (name, _labels(labels), _value(value[-1]))
+            )
+            lines.append(
+                '%s_count%s %d' % (name, _labels(labels), cumulative)
+            )
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,153 @@
+# Copyright 2017, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# (c) 2017, Kevin Carter <kevin.carter@rackspace.com>
+
+import datetime
+import json
+import uuid
+
+try:
+    from collections import abc
+except ImportError:
+    import collections as abc
+
+from flask import Response
+
+from oslo_config import cfg
+
+from cruton import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+CONF = cfg.CONF
+JSON_MIMETYPE = 'application/json'
+
+
+def timestamp(value):
+    """Return a datetime formatted the way the API returns it.
+
+    Values which are not a datetime are returned as they are.
+
+    :param value: Time to format
+    :type value: datetime
+    :return: string || object
+    """
+    if isinstance(value, datetime.datetime):
+        return '%02d-%02d-%04d %02d:%02d:%02d' % (
+            value.day,
+            value.month,
+            value.year,
+            value.hour,
+            value.minute,
+            value.second
+        )
+    return value
+
+
+def _default(value):
+    """Return a JSON type for the values read from a data store.
+
+    Sets become lists, datetimes are formatted with timestamp and lazily
+    decoded mappings are decoded. The encoders call this while encoding, so
+    rows are not copied first.
+    """
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    elif isinstance(value, abc.Mapping):
+        return dict(value)
+    elif isinstance(value, datetime.datetime):
+        return timestamp(value)
+    elif isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+_JSON_ENCODER = json.JSONEncoder(default=_default, separators=(',', ':'))
+
+
+def _json_dumps(data):
+    return _JSON_ENCODER.encode(data).encode('utf-8')
+
+
+def _orjson_dumps(data):
+    return orjson.dumps(
+        data,
+        default=_default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    )
+
+
+# Encoders returning compact UTF-8 JSON, by name.
+ENCODERS = {'json': _json_dumps}
+if orjson is not None:
+    ENCODERS['orjson'] = _orjson_dumps
+
+
+def encoder():
+    """Return the encoder set by the json_encoder option.
+
+    The fastest installed encoder is used when the option is set to auto.
+
+    :return: function
+    """
+    name = CONF['api']['json_encoder']
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in ENCODERS else 'json'
+    try:
+        return ENCODERS[name]
+    except KeyError:
+        raise ValueError('JSON encoder [ %s ] is not installed' % name)
+
+
+def dumps(data):
+    """Return data serialized as compact UTF-8 JSON.
+
+    :param data: Data to serialize
+    :type data: object
+    :return: bytes
+    """
+    with metrics.timer(stage='serialize'):
+        return encoder()(data)
+
+
+def jsonify(data, status=200, headers=None):
+    """Return a JSON response.
+
+    :param data: Data to serialize
+    :type data: object
+    :param status: HTTP status code
+    :type status: int
+    :param headers: Response headers
+    :type headers: dict
+    :return: Response
+    """
+    return Response(
+        dumps(data),
+        status=status,
+        headers=headers,
+        mimetype=JSON_MIMETYPE
+    )
+
+
+def output_json(data, code, headers=None):
+    """Return a JSON response for a resource returning data and a code.
+
+    This is registered as the JSON representation of the API.
+    """
+    return jsonify(data=data, status=code, headers=headers)
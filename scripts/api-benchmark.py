@@ -0,0 +1,519 @@
+#! /usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+import uuid
+
+DOCS = """
+Benchmark the Cruton API against a local data store.
+
+Synthetic entities, environments and devices are seeded through the API
+using bulk POSTs, every device carries OpenStack-Ansible hostvars sized
+vars. The latency and throughput of the common requests are then measured
+in process using the Flask test client and written as JSON. The CPU time
+spent serializing a listing of devices is measured on its own.
+
+The sqlite driver is used by default with a new database file. Another
+driver can be benchmarked by providing its configuration file.
+
+USAGE:
+python scripts/api-benchmark.py --devices 100000 --output bench.json
+
+python scripts/api-benchmark.py --devices 10000 \
+  --driver cassandra \
+  --config-file /etc/cruton/cruton.ini
+"""
+
+COMPONENTS = [
+    'aodh_api', 'ceilometer_central', 'cinder_api', 'cinder_volume',
+    'glance_api', 'heat_api', 'horizon', 'keystone', 'neutron_agent',
+    'neutron_server', 'nova_api_os_compute', 'nova_compute',
+    'nova_conductor', 'nova_scheduler', 'galera', 'rabbitmq', 'memcached',
+    'repo_server', 'rsyslog', 'utility'
+]
+
+
+def percentile(samples, pct):
+    """Return the percentile of sorted samples using the nearest rank."""
+    if not samples:
+        return 0.0
+    rank = int(round(pct / 100.0 * len(samples) + 0.5)) - 1
+    return samples[max(0, min(rank, len(samples) - 1))]
+
+
+def summarize(samples, elapsed):
+    """Return the latency percentiles in ms and the throughput of samples."""
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'min_ms': round(samples[0] * 1000, 3),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'ops_per_second': round(len(samples) / elapsed, 2) if elapsed else 0
+    }
+
+
+def host_vars(rand, dev_id, component):
+    """Return vars sized like the OpenStack-Ansible hostvars of a host."""
+    networks = dict()
+    for net in ('container', 'storage', 'tunnel'):
+        networks['%s_address' % net] = {
+            'address': '172.%d.%d.%d' % (
+                rand.randint(16, 31),
+                rand.randint(0, 255),
+                rand.randint(1, 254)
+            ),
+            'bridge': 'br-%s' % net,
+            'interface': 'eth%d' % rand.randint(1, 3),
+            'netmask': '255.255.252.0',
+            'type': 'veth'
+        }
+
+    variables = {
+        'ansible_host': networks['container_address']['address'],
+        'ansible_ssh_host': networks['container_address']['address'],
+        'component': component,
+        'container_name': dev_id,
+        'container_networks': networks,
+        'physical_host': 'infra%d' % rand.randint(1, 3),
+        'physical_host_group': '%s_hosts' % component,
+        'properties': {
+            'service_name': component.split('_')[0],
+            'is_metal': rand.random() < 0.2
+        },
+        'ipxe_kernel_url': 'http://repo/%s/vmlinuz' % component,
+        'ipxe_initrd_url': 'http://repo/%s/initrd' % component
+    }
+    for i in range(40):
+        variables['%s_option_%d' % (component, i)] = 'value-%d' % (
+            rand.randint(0, 100000)
+        )
+    return variables
+
+
+def device(rand, dev_id):
+    """Return a synthetic device."""
+    component = rand.choice(COMPONENTS)
+    variables = host_vars(rand=rand, dev_id=dev_id, component=component)
+    tags = [component]
+    if variables['properties']['is_metal']:
+        tags.append('is_metal')
+    return {
+        'dev_id': dev_id,
+        'name': dev_id,
+        'rack_id': 'rack%d' % rand.randint(1, 40),
+        'row_id': 'row%d' % rand.randint(1, 4),
+        'tags': tags,
+        'access_ip': dict(
+            [
+                (k, v['address'])
+                for k, v in variables['container_networks'].items()
+            ]
+        ),
+        'vars': variables
+    }
+
+
+class Benchmark(object):
+    """Seed and measure the API.
+
+    :param client: Flask test client
+    :type client: object
+    :param args: Parsed command line arguments
+    :type args: object
+    """
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.rand = random.Random(args.seed)
+        self.results = dict()
+        self.devices = list()
+
+    def request(self, method, url, body=None, expect=(200, 201, 207)):
+        """Run a request, return the seconds it took."""
+        kwargs = dict()
+        if body is not None:
+            kwargs['data'] = json.dumps(body)
+            kwargs['content_type'] = 'application/json'
+        start = timeit.default_timer()
+        resp = getattr(self.client, method)(url, **kwargs)
+        elapsed = timeit.default_timer() - start
+        if resp.status_code not in expect:
+            raise SystemExit(
+                '%s %s returned %s: %s' % (
+                    method.upper(), url, resp.status_code, resp.data[:500]
+                )
+            )
+        return elapsed
+
+    def measure(self, name, requests):
+        """Run requests, a list of method, url and body tuples."""
+        samples = list()
+        start = timeit.default_timer()
+        for method, url, body in requests:
+            samples.append(self.request(method=method, url=url, body=body))
+        self.report(
+            name=name,
+            samples=samples,
+            elapsed=timeit.default_timer() - start
+        )
+
+    def report(self, name, samples, elapsed):
+        """Summarize and print the samples of a measurement."""
+        self.results[name] = summarize(samples=samples, elapsed=elapsed)
+        print(
+            '%-16s p50 %10.3f ms  p99 %10.3f ms  %10.2f ops/s' % (
+                name,
+                self.results[name]['p50_ms'],
+                self.results[name]['p99_ms'],
+                self.results[name]['ops_per_second']
+            ),
+            file=sys.stderr
+        )
+
+    @staticmethod
+    def env_url(ent_id, env_id):
+        return '/v1/entities/%s/environments/%s' % (ent_id, env_id)
+
+    def seed(self):
+        """Seed entities, environments and devices through the API."""
+        environments = list()
+        for e in range(self.args.entities):
+            ent_id = 'BenchEntity%d' % e
+            self.request(
+                method='put',
+                url='/v1/entities/%s' % ent_id,
+                body={'name': ent_id, 'tags': ['benchmark']}
+            )
+            for v in range(self.args.environments):
+                env_id = 'BenchEnvironment%d' % v
+                self.request(
+                    method='put',
+                    url=self.env_url(ent_id, env_id),
+                    body={'name': env_id, 'tags': ['benchmark']}
+                )
+                environments.append((ent_id, env_id))
+
+        batches = list()
+        for env_index, (ent_id, env_id) in enumerate(environments):
+            count = self.args.devices // len(environments)
+            if env_index < self.args.devices % len(environments):
+                count += 1
+            batch = list()
+            for d in range(count):
+                dev_id = 'bench-%d-%d-%d' % (
+                    env_index,
+                    d,
+                    self.rand.randint(0, 99999)
+                )
+                item = device(rand=self.rand, dev_id=dev_id)
+                # Only what the measured requests need is kept in memory.
+                self.devices.append((ent_id, env_id, {
+                    'dev_id': dev_id,
+                    'tag': item['tags'][0],
+                    'physical_host': item['vars']['physical_host']
+                }))
+                batch.append(item)
+                if len(batch) == self.args.batch_size:
+                    batches.append((ent_id, env_id, batch))
+                    batch = list()
+            if batch:
+                batches.append((ent_id, env_id, batch))
+
+        self.measure(
+            name='seed_bulk_post',
+            requests=[
+                ('post', '%s/devices' % self.env_url(ent_id, env_id), batch)
+                for ent_id, env_id, batch in batches
+            ]
+        )
+
+    def serialization(self):
+        """Measure serializing a listing of devices.
+
+        The devices are shaped as the data store returns them, with sets,
+        datetimes and UUIDs, and serialized as a listing response is.
+        """
+        from cruton import serialize
+
+        now = datetime.datetime.utcnow()
+        rows = list()
+        for d in range(self.args.listing_size):
+            row = device(rand=self.rand, dev_id='bench-listing-%d' % d)
+            row.update({
+                'id': uuid.uuid4(),
+                'ent_id': 'BenchEntity0',
+                'env_id': 'BenchEnvironment0',
+                'created_at': now,
+                'updated_at': now,
+                'tags': set(row['tags']),
+                'ports': dict(),
+                'links': dict(),
+                'description': None
+            })
+            rows.append(row)
+
+        samples = list()
+        start = timeit.default_timer()
+        for _ in range(max(1, self.args.iterations // 100)):
+            sample_start = timeit.default_timer()
+            serialize.dumps(rows)
+            samples.append(timeit.default_timer() - sample_start)
+        self.report(
+            name='serialize_listing',
+            samples=samples,
+            elapsed=timeit.default_timer() - start
+        )
+
+    def sample(self):
+        """Return a random seeded device."""
+        return self.rand.choice(self.devices)
+
+    def run(self):
+        """Measure every request type."""
+        iterations = self.args.iterations
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, item = self.sample()
+            requests.append((
+                'get',
+                '%s/devices/%s' % (
+                    self.env_url(ent_id, env_id),
+                    item['dev_id']
+                ),
+                None
+            ))
+        self.measure(name='get_by_id', requests=requests)
+
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, _ = self.sample()
+            requests.append((
+                'get',
+                '%s/devices?limit=%d' % (
+                    self.env_url(ent_id, env_id),
+                    self.args.page_size
+                ),
+                None
+            ))
+        self.measure(name='list_page', requests=requests)
+
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, item = self.sample()
+            requests.append((
+                'get',
+                '%s/devices?tag=%s' % (
+                    self.env_url(ent_id, env_id),
+                    item['tag']
+                ),
+                None
+            ))
+        self.measure(name='search_tag', requests=requests)
+
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, item = self.sample()
+            requests.append((
+                'get',
+                '%s/devices?var=%s' % (
+                    self.env_url(ent_id, env_id),
+                    item['physical_host']
+                ),
+                None
+            ))
+        self.measure(name='search_var', requests=requests)
+
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, item = self.sample()
+            requests.append((
+                'get',
+                '%s/devices?name=%s&fuzzy=true' % (
+                    self.env_url(ent_id, env_id),
+                    item['dev_id'].split('-')[-1]
+                ),
+                None
+            ))
+        self.measure(name='search_fuzzy', requests=requests)
+
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, _ = self.sample()
+            requests.append((
+                'head',
+                '%s/devices' % self.env_url(ent_id, env_id),
+                None
+            ))
+        self.measure(name='head_count', requests=requests)
+
+        requests = list()
+        for _ in range(iterations):
+            ent_id, env_id, item = self.sample()
+            body = device(rand=self.rand, dev_id=item['dev_id'])
+            body.pop('dev_id')
+            body['description'] = 'updated %d' % self.rand.randint(0, 99999)
+            requests.append((
+                'put',
+                '%s/devices/%s' % (
+                    self.env_url(ent_id, env_id),
+                    item['dev_id']
+                ),
+                body
+            ))
+        self.measure(name='put_single', requests=requests)
+
+        requests = list()
+        for i in range(max(1, iterations // 10)):
+            ent_id, env_id, _ = self.sample()
+            batch = [
+                device(rand=self.rand, dev_id='bench-bulk-%d-%d' % (i, d))
+                for d in range(self.args.batch_size)
+            ]
+            requests.append((
+                'post',
+                '%s/devices' % self.env_url(ent_id, env_id),
+                batch
+            ))
+        self.measure(name='post_bulk', requests=requests)
+
+
+def args_parser():
+    parser = argparse.ArgumentParser(
+        description=DOCS,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--devices',
+        type=int,
+        default=10000,
+        help='Number of devices to seed, for example 10000, 100000 or 1000000.'
+    )
+    parser.add_argument(
+        '--entities',
+        type=int,
+        default=1,
+        help='Number of entities to seed.'
+    )
+    parser.add_argument(
+        '--environments',
+        type=int,
+        default=10,
+        help='Number of environments to seed within every entity.'
+    )
+    parser.add_argument(
+        '--iterations',
+        type=int,
+        default=1000,
+        help='Number of requests measured for every request type.'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Number of devices within a bulk POST.'
+    )
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=100,
+        help='Number of devices within a listing page.'
+    )
+    parser.add_argument(
+        '--listing-size',
+        type=int,
+        default=10000,
+        help='Number of devices within the listing serialized.'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=1,
+        help='Random seed, the same seed seeds the same data.'
+    )
+    parser.add_argument(
+        '--driver',
+        default='sqlite',
+        help='Data store driver to benchmark.'
+    )
+    parser.add_argument(
+        '--database',
+        help='Database file of the sqlite driver, a new file is used by'
+             ' default.'
+    )
+    parser.add_argument(
+        '--config-file',
+        action='append',
+        default=list(),
+        help='Cruton configuration file, this can be used more than once.'
+    )
+    parser.add_argument(
+        '--output',
+        help='File the JSON results are written to, defaults to stdout.'
+    )
+    return parser
+
+
+def main():
+    args = args_parser().parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cruton-benchmark-')
+    database = args.database or os.path.join(workdir, 'cruton.db')
+    config_file = os.path.join(workdir, 'cruton.ini')
+    with open(config_file, 'w') as f:
+        f.write('[data_store]\ndriver = %s\ndatabase = %s\n' % (
+            args.driver,
+            database
+        ))
+
+    # The API reads its configuration from the command line.
+    sys.argv = [sys.argv[0]]
+    for path in args.config_file + [config_file]:
+        sys.argv.extend(['--config-file', path])
+
+    import cruton
+    from cruton import main as cruton_main
+    app = cruton_main.init_application()
+
+    benchmark = Benchmark(client=app.test_client(), args=args)
+    benchmark.seed()
+    benchmark.run()
+    benchmark.serialization()
+
+    report = {
+        'cruton_version': cruton.__version__,
+        'driver': args.driver,
+        'python': platform.python_version(),
+        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'entities': args.entities,
+        'environments': args.environments,
+        'devices': args.devices,
+        'iterations': args.iterations,
+        'batch_size': args.batch_size,
+        'page_size': args.page_size,
+        'listing_size': args.listing_size,
+        'seed': args.seed,
+        'results': benchmark.results
+    }
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()